@@ -0,0 +1,146 @@
+##################################################################### Compiled Data Bundle ##################################################################
+
+import os
+import json
+import hashlib
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import shapely
+
+# Increase whenever the layout of the bundle changes, so that older bundles are compiled again
+BUNDLE_VERSION = 1
+
+# Static inputs of the model; name : (path, pandas reader options). Per-date flight files (data/mxp/<month>/<date>) change with the
+# examined date and stay outside the bundle, as do mxp_data.csv and airlines.xlsx, which only the offline Toolkit.flight_ingestion reads.
+SOURCES = {'pop_data' : ("data/milano/milano_population_data.xlsx",{}),
+           'varese_pop' : ("data/milano/varese_population_data.xlsx",{}),
+           'arr_to_check' : ("data/mxp/arr_to_checkin.xlsx",{'index_col' : 0}),
+           'arr_to_xray' : ("data/mxp/arr_to_xray.xlsx",{'index_col' : 0}),
+           'transit_stops' : ("data/mxp/transit_stops.csv",{'index_col' : 0}),
+           'stations_all' : ("data/milano/stations_all.csv",{'delimiter' : ','}),
+           'polygons' : ("data/milano/nils_milano.geojson",{})}
+
+def get_sources_hash(sources=SOURCES):
+
+    '''
+    Content hash of the static inputs, together with the bundle version:
+
+    Args:
+        sources (dict) : Static inputs of the model, see SOURCES
+
+    Returns:
+        hash (str): Hexadecimal sha256 digest.
+
+    '''
+    digest = hashlib.sha256(f"bundle-v{BUNDLE_VERSION}".encode())
+    for name,(path,_) in sorted(sources.items()):
+        digest.update(name.encode())
+        with open(path,'rb') as f:
+            digest.update(f.read())
+    return digest.hexdigest()
+
+def read_sources(sources=SOURCES):
+
+    '''
+    Reads the static inputs from their original Excel, CSV and GeoJSON files:
+
+    Args:
+        sources (dict) : Static inputs of the model, see SOURCES
+
+    Returns:
+        tables (dict): pd.DataFrame (gpd.GeoDataFrame for GeoJSON files) per input.
+
+    '''
+    tables = {}
+    for name,(path,options) in sources.items():
+        if path.endswith('.geojson'):
+            tables[name] = gpd.read_file(path)
+        elif path.endswith('.csv'):
+            tables[name] = pd.read_csv(path,**options)
+        else:
+            tables[name] = pd.read_excel(path,**options)
+    return tables
+
+def _encode_values(values):
+
+    # Numeric columns are stored natively, anything else as a JSON list to keep mixed types (e.g. 1 and 'CAR') intact
+    values = np.asarray(values)
+    if values.dtype.kind in 'biuf':
+        return values
+    return np.array(json.dumps(pd.Series(values,dtype=object).tolist()))
+
+def _decode_values(stored):
+    if stored.dtype.kind == 'U' and stored.ndim == 0:
+        return np.array(json.loads(str(stored)),dtype=object)
+    return stored
+
+def _encode_table(name,table):
+    arrays = {}
+    geometry = table.geometry.name if isinstance(table,gpd.GeoDataFrame) else None
+    columns = [x for x in table.columns if x != geometry]
+    meta = {'columns' : [str(x) for x in columns],'index' : table.index.name,'geometry' : geometry,
+            'crs' : table.crs.to_string() if geometry != None and table.crs != None else None}
+    arrays[f'{name}/__meta__'] = np.array(json.dumps(meta))
+    arrays[f'{name}/__index__'] = _encode_values(table.index.to_numpy())
+    for idx,column in enumerate(columns):
+        arrays[f'{name}/{idx}'] = _encode_values(table[column].to_numpy())
+    if geometry != None:
+        arrays[f'{name}/__geometry__'] = np.array(shapely.to_wkb(table.geometry.values,hex=True),dtype='U')
+    return arrays
+
+def _decode_table(name,stored):
+    meta = json.loads(str(stored[f'{name}/__meta__']))
+    index = pd.Index(_decode_values(stored[f'{name}/__index__']),name=meta['index'])
+    if index.dtype == object:
+        index = index.infer_objects()
+    table = pd.DataFrame({column : _decode_values(stored[f'{name}/{idx}']) for idx,column in enumerate(meta['columns'])},index=index)
+    if meta['geometry'] != None:
+        table[meta['geometry']] = shapely.from_wkb(stored[f'{name}/__geometry__'])
+        table = gpd.GeoDataFrame(table,geometry=meta['geometry'],crs=meta['crs'])
+    return table
+
+def compile_data_bundle(path='data/data_bundle.npz',sources=SOURCES):
+
+    '''
+    Converts the static inputs of the model into a single compiled bundle:
+
+    Args:
+        path (str) : File where the bundle is stored
+        sources (dict) : Static inputs of the model, see SOURCES
+
+    Returns:
+        tables (dict): pd.DataFrame (gpd.GeoDataFrame for GeoJSON files) per input.
+
+    '''
+    tables = read_sources(sources)
+    arrays = {'__hash__' : np.array(get_sources_hash(sources))}
+    for name,table in tables.items():
+        arrays.update(_encode_table(name,table))
+    np.savez(path,**arrays)
+    return tables
+
+def load_data_bundle(path='data/data_bundle.npz',sources=SOURCES):
+
+    '''
+    Loads the static inputs of the model from the compiled bundle; it is compiled again when any source or the bundle version changes:
+
+    Args:
+        path (str) : File where the bundle is stored
+        sources (dict) : Static inputs of the model, see SOURCES
+
+    Returns:
+        tables (dict): pd.DataFrame (gpd.GeoDataFrame for GeoJSON files) per input.
+
+    '''
+    if os.path.exists(path):
+        with np.load(path) as stored:
+            if str(stored['__hash__']) == get_sources_hash(sources):
+                return {name : _decode_table(name,stored) for name in sources.keys()}
+    return compile_data_bundle(path,sources)
+
+if __name__ == "__main__":
+
+    # Run from the repository root: python -m Toolkit.data_bundle
+    compile_data_bundle()
+    print(f"Data bundle compiled (hash {get_sources_hash()})")
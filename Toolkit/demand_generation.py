@@ -3,79 +3,95 @@
 import os
 import pandas as pd
 import numpy as np
-from shapely import geometry
+from shapely import geometry,contains_xy
 import random
 import utm
 import calendar
 import math
+from Toolkit.flight_index import build_flight_index
 pd.options.mode.chained_assignment = None 
 
 def weighted_choice(percent=50):
     return random.randrange(100) < percent
 
-def generate_passenger_demand (pop_data,passenger_data,cluster,date,varese_pop,flag="departures",save=False):
+def get_population_distribution(pop_data,varese_pop):
 
     '''
-    Dividing expected passenger per cluster to regions according to population densities:
+    Computes the probability that a traveller originates from each region; it only depends on static data
+    and is therefore computed once per run.
 
     Args:
         pop_data (xlsx file): Dataframe read that should be stored in path data/milano/milano_population_data.xlsx directory;
                                     derived from https://dati.comune.milano.it/dataset/ds25-popolazione-proiezione-popolazione-quartiere    
-        passenger_data (csv file): Dataframe read that should be stored in path data/mxp/<examined month (Name)>/<examined date (%d-%m-%YYYY)>/trip_matrix.csv;
-                                    derived from flights_to_demand.ipynb\
-        cluster (int) : Examined time-window
-        date (str) : date in the (%d-%m-%YYYY) format
         varese_pop (xlsx file): Dataframe read that should be stored in path data/milano/varese_population_data.xlsx directory;
                                     derived from wikipedia
-        save (bool) : Optional parameter to save all resulting Dataframes
 
     Returns:
-        demand (pd.Dataframe): Dataframe indexed by the NIL of the region and number of travelers associated to the NIL for that time-window.
+        distribution (pd.Dataframe): Dataframe with the Quartiere, NIL, Totale and Percentage of each region.
 
     '''
     # Create probabilities for each region
     pop_data = pop_data[pop_data["Anno"]==2018]
     pop_data = pop_data[["Quartiere","NIL","Totale"]]
-    #
 
     population = pop_data["Totale"].sum(axis=0)
     pop_data["Percentage"] = (0.46)*pop_data["Totale"]/population # Milano Share/(Milano + Varese Share)
 
-
     varese_pop = varese_pop[["Quartiere","NIL","Totale"]]
     varese_population = varese_pop["Totale"].sum(axis=0)
-    varese_pop["Percentage"] = varese_pop["Totale"]/varese_population
     varese_pop["Percentage"] = 0.15*varese_pop["Totale"]/varese_population  # Varese Share/(Milano + Varese Share)
 
     direct_mxp = pd.DataFrame([["MXP",999,0,0.39]],columns=["Quartiere","NIL","Totale","Percentage"])
-    pop_data = pd.concat([pop_data, varese_pop,direct_mxp], axis=0)
-    pop_data["Cum_perc"] = pop_data["Percentage"].cumsum()
-    pop_data = pop_data.reset_index(drop=True)
+    distribution = pd.concat([pop_data, varese_pop,direct_mxp], axis=0)
+    distribution = distribution.reset_index(drop=True)
+    return distribution
 
-    # Assign travelers to regions based on created probabilities
-    pop_data["Travellers"] = 0
-    users = int(passenger_data[str(cluster)].sum())
-    for _ in range(users):
-        prob = np.random.rand()
-        high = pop_data[pop_data["Cum_perc"]>=prob]
-        row = high[high["Cum_perc"]-high["Percentage"]<=prob]
-        pop_data.loc[row.index,"Travellers"]+=1
+def generate_passenger_demand (pop_data,passenger_data,cluster,date,varese_pop,flag="departures",save=False,distribution=None,rng=None):
 
-    # Examined Month
-    m = int(date.split("-")[1])
+    '''
+    Dividing expected passenger per cluster to regions according to population densities:
 
-    # Create a new directory because it does not exist
-    path = f"data/milano/{calendar.month_name[m]}/{date}"
-    isExist = os.path.exists(path)
-    if not isExist:
-        os.makedirs(path)
+    Args:
+        pop_data (xlsx file): Dataframe read that should be stored in path data/milano/milano_population_data.xlsx directory;
+                                    derived from https://dati.comune.milano.it/dataset/ds25-popolazione-proiezione-popolazione-quartiere    
+        passenger_data (csv file): Dataframe read that should be stored in path data/mxp/<examined month (Name)>/<examined date (%d-%m-%YYYY)>/trip_matrix.csv;
+                                    derived from flights_to_demand.ipynb\
+        cluster (int) : Examined time-window
+        date (str) : date in the (%d-%m-%YYYY) format
+        varese_pop (xlsx file): Dataframe read that should be stored in path data/milano/varese_population_data.xlsx directory;
+                                    derived from wikipedia
+        save (bool) : Optional parameter to save all resulting Dataframes
+        distribution (pd.Dataframe) : Optional output of get_population_distribution; computed from pop_data and varese_pop if not given
+        rng (np.random.Generator or int) : Optional random generator (or seed) for reproducible demand
+
+    Returns:
+        demand (pd.Dataframe): Dataframe indexed by the NIL of the region and number of travelers associated to the NIL for that time-window.
+
+    '''
+    if distribution is None:
+        distribution = get_population_distribution(pop_data,varese_pop)
+    rng = np.random.default_rng(rng)
+
+    # Assign travelers to regions based on created probabilities with a single draw
+    users = int(passenger_data[str(cluster)].sum())
+    probabilities = distribution["Percentage"].to_numpy(dtype=float)
+    demand = pd.DataFrame({"NIL": distribution["NIL"].to_numpy(),
+                           "Travellers": rng.multinomial(users,probabilities/probabilities.sum())})
 
     # Save to file if desired
     if save :
-        pop_data[['NIL','Travellers']].to_csv(f'{path}/demand_{flag}_{cluster}.csv',index=False)
+
+        # Examined Month
+        m = int(date.split("-")[1])
+
+        # Create a new directory because it does not exist
+        path = f"data/milano/{calendar.month_name[m]}/{date}"
+        isExist = os.path.exists(path)
+        if not isExist:
+            os.makedirs(path)
+        demand.to_csv(f'{path}/demand_{flag}_{cluster}.csv',index=False)
     
     # Return demand to the simulation
-    demand = pop_data[['NIL','Travellers']]
     demand.index = demand.NIL
     return demand
 
@@ -101,16 +117,59 @@ def generate_random_coordinates(number, polygon):
     minx, miny, maxx, maxy = polygon.bounds
     while len(points) < number:
 
-        # Uniformly select from within the boundaries
-        a,b = np.random.uniform(minx, maxx), np.random.uniform(miny, maxy)
-        pnt = geometry.Point(a,b)
-        if polygon.contains(pnt):
-            rand = 1
-            for i in range(rand):
-                points.append((a,b))
+        # Uniformly select a batch from within the boundaries and keep the ones inside the polygon
+        batch = max(2*(number-len(points)),16)
+        a,b = np.random.uniform(minx, maxx, batch), np.random.uniform(miny, maxy, batch)
+        inside = contains_xy(polygon,a,b)
+        points.extend(zip(a[inside],b[inside]))
     points = points[0:number]
     return points
 
+def build_point_pools(polygons,pool_size=2000):
+
+    '''
+    Builds a pool of valid random points for every NIL, so that sampling a point becomes an index draw:
+
+    Args:
+        polygons (GeoJSON) : Set of polygons describing the spatial characteristics of the NILS
+        pool_size (int) : Amount of points per NIL
+
+    Returns:
+        pools (dict): Arrays of points (Longitude,Latitude,X,Y) per NIL; X,Y in the UTM format
+
+    '''
+    pools = {}
+    for _,r in polygons.iterrows():
+        points = np.array(generate_random_coordinates(pool_size,r['geometry']))
+        X,Y,_,_ = utm.from_latlon(points[:,1],points[:,0])
+        pools[int(r['ID_NIL'])] = np.column_stack([points,X,Y])
+    return pools
+
+def load_point_pools(polygons,path='data/milano/nil_point_pools.npz',source='data/milano/nils_milano.geojson',pool_size=2000):
+
+    '''
+    Loads the point pools of the NILs from disk; they are built and stored again when the NILs GeoJSON changes:
+
+    Args:
+        polygons (GeoJSON) : Set of polygons describing the spatial characteristics of the NILS
+        path (str) : File where the pools are stored
+        source (str) : GeoJSON file that the polygons were read from
+        pool_size (int) : Amount of points per NIL
+
+    Returns:
+        pools (dict): Arrays of points (Longitude,Latitude,X,Y) per NIL; X,Y in the UTM format
+
+    '''
+    if os.path.exists(path) and os.path.getmtime(path) >= os.path.getmtime(source):
+        with np.load(path) as stored:
+            pools = {int(k): stored[k] for k in stored.files}
+        if all(x.shape[0] == pool_size for x in pools.values()):
+            return pools
+
+    pools = build_point_pools(polygons,pool_size)
+    np.savez_compressed(path,**{str(k): v for k,v in pools.items()})
+    return pools
+
 def rand_coord_within_circle(point,radius):
 
     '''
@@ -135,7 +194,73 @@ def rand_coord_within_circle(point,radius):
     return (y,x)
 
 
-def demand_to_flight(date,cluster,demand,passenger_data,polygons,varese_pop,flight_data,no_persons=list(range(1,6)),flag='departures',save=False):
+def rand_coords_within_circle(lat,lon,radius,number,rng=None):
+
+    '''
+    Generates random points within a circle around a central point (vectorized version of rand_coord_within_circle):
+
+    Args:
+        lat (float) : Latitude of the central point in the WGS84 format
+        lon (float) : Longitude of the central point in the WGS84 format
+        radius (int) : Radius of the designated circle by the point.
+        number (int) : Amount of points to be generated
+        rng (np.random.Generator) : Optional random generator
+
+    Returns:
+        lon,lat (np.array): Longitude,Latitude coordinates of the points in the WGS84 format.
+
+    '''
+    rng = np.random.default_rng(rng)
+    x1,y1,z_n,z_l = utm.from_latlon(lat,lon)
+    t = rng.random(number)
+    u = rng.random(number)
+    x = x1 + radius * np.sqrt(t) * np.cos(2 * np.pi * u)
+    y = y1 + radius * np.sqrt(t) * np.sin(2 * np.pi * u)
+
+    lat,lon = utm.to_latlon(x, y, z_n,z_l)
+    return lon,lat
+
+def sample_group_sizes(counts,no_persons=list(range(1,6)),rng=None):
+
+    '''
+    Splits the travellers of every (flight,region) pair into groups. Each group size is sampled uniformly among
+    the sizes that do not exceed the remaining travellers of the pair; all pairs are sampled simultaneously.
+
+    Args:
+        counts (np.array) : Travellers per (flight,region) pair
+        no_persons (list) : The possible group size of all trips
+        rng (np.random.Generator) : Optional random generator
+
+    Returns:
+        owner (np.array): Index of the (flight,region) pair of every group
+        sizes (np.array): Number of persons of every group
+
+    '''
+    rng = np.random.default_rng(rng)
+    group_sizes = np.sort(np.asarray(no_persons))
+    remaining = np.asarray(counts,dtype=np.int64).copy()
+
+    owner,sizes = [],[]
+    active = np.flatnonzero(remaining > 0)
+    while len(active) > 0:
+
+        # Number of sizes that fit in the remaining travellers of each pair
+        allowed = np.searchsorted(group_sizes,remaining[active],side='right')
+        sample = group_sizes[np.minimum((rng.random(len(active))*allowed).astype(int),len(group_sizes)-1)]
+        sample = np.where(allowed == 0,remaining[active],sample)
+
+        owner.append(active)
+        sizes.append(sample)
+        remaining[active] -= sample
+        active = active[remaining[active] > 0]
+
+    if owner == []:
+        return np.zeros(0,dtype=int),np.zeros(0,dtype=int)
+    owner,sizes = np.concatenate(owner),np.concatenate(sizes)
+    order = np.argsort(owner,kind='stable')
+    return owner[order],sizes[order]
+
+def demand_to_flight(date,cluster,demand,passenger_data,polygons,varese_pop,flight_data,no_persons=list(range(1,6)),flag='departures',save=False,rng=None,pools=None,flight_index=None):
     
     '''
     Generates exact trip characteristics per cluster based on the generate_demand provided information:
@@ -155,108 +280,102 @@ def demand_to_flight(date,cluster,demand,passenger_data,polygons,varese_pop,flig
                                     derived from wikipedia
         no_persons (list) : The possible group size of all trips
         save (bool) : Optional parameter to save all resulting Dataframe
+        rng (np.random.Generator or int) : Optional random generator (or seed) for reproducible trips
+        pools (dict) : Optional output of load_point_pools; points are sampled from the polygons if not given
+        flight_index (dict) : Optional output of build_flight_index for flight_data; built here if not given
 
     Returns:
         user_df (pd.Dataframe): Dataframe containing exact information per initiated trip for that time-window.
 
     '''
+    rng = np.random.default_rng(rng)
 
     # We isolate the flights occurring within this cluster
-    flights = passenger_data[str(cluster)]
-
-    users = []
-    for idx,f in flights.items():
-        gate = flight_data[flight_data['Flight Code']==idx]['Gate'].values[0]
-        schengen = flight_data[flight_data['Flight Code']==idx]['SCHENGEN'].values[0]
-        f_type = flight_data[flight_data['Flight Code']==idx]['TYPE'].values[0]
-
-        # We start sampling for users per flight
-        choice = []
-        for _ in range(int(f)):
-
-            # Weights are updated each choice to make sure that a region provides exactly the demand its has
-            weight_values = demand['Travellers'].tolist()/demand['Travellers'].sum()
-            weights = {NIL :  w for NIL,w in zip(demand.index.tolist(),weight_values)}
-            c = np.random.choice(list(weights.keys()), p = list(weights.values()))
-
-            # Remove travelers from that demand and append region of choice
-            demand.at[c,"Travellers"]-=1
-            choice.append(c)
-
-        # Sort choice list to identify potential groups of passengers
-        choice.sort()
-        
-        # Start sampling different group sizes
-        p_list = []
-        set_nils = list(set(choice)) # Reduce choice to single NIL observations
-        for c in set_nils:
-            count = choice.count(c) # Count observations
-
-            # Sample number of persons as long as they are less than the current counts
-            while True:
-                sample = random.choice(no_persons)
-                if sample <= count:
-                    p_list.append(sample)
-                    count-=sample
-
-                if count == 0:
-                    break
-        
-        # Complete df by sampling random point and adding X,Y
-        counter = 0
-        for u in p_list:
-
-            if choice[counter] <= 100:
-                poly = polygons[polygons["ID_NIL"]==choice[counter]]['geometry'].values[0]
-                point = generate_random_coordinates(1,poly)
-                lon,lat = point[0]
-            elif choice[counter] <= 200 :
-                central_point = geometry.Point(varese_pop[varese_pop["NIL"]==choice[counter]].values[0][-2:])
-                point = [rand_coord_within_circle(central_point,radius = 3000)]
-                lon,lat = point[0]
-            else:
-                lon,lat = 8.711128,45.62712
-            
-            X,Y,A,B = utm.from_latlon(lat,lon)
-            if not(schengen): # passport and schengen are used the same
-                bags = weighted_choice(80) # 55 percent checks bags
+    flights = passenger_data[str(cluster)].astype(int)
+    flights = flights[flights > 0]
+    codes = flights.index.to_numpy()
+
+    # Flight metadata is read from the flight index
+    if flight_index is None:
+        flight_index = build_flight_index(flight_data)
+    records = [flight_index[x] for x in codes]
+    gates = np.array([x.gate for x in records],dtype=int)
+    schengen = np.array([x.schengen for x in records],dtype=bool)
+    f_types = np.array([x.f_type for x in records],dtype=object)
+    times = np.array([x.time for x in records],dtype=int)
+
+    # Regions are sorted to identify potential groups of passengers
+    demand = demand.sort_index()
+    nils = demand.index.to_numpy()
+    available = demand['Travellers'].to_numpy().astype(np.int64)
+
+    # Sample regions per flight without replacement, so that a region provides exactly the demand it has
+    counts = np.zeros((len(codes),len(nils)),dtype=np.int64)
+    for idx,f in enumerate(flights.to_numpy()):
+        counts[idx] = rng.multivariate_hypergeometric(available,min(f,available.sum()))
+        available -= counts[idx]
+
+    # Start sampling different group sizes
+    pair_flight,pair_nil = np.nonzero(counts)
+    owner,group_sizes = sample_group_sizes(counts[pair_flight,pair_nil],no_persons,rng)
+    group_flight,group_nil = pair_flight[owner],nils[pair_nil[owner]]
+    number = len(group_sizes)
+
+    # Complete df by sampling random point per group (default is MXP)
+    lon,lat = np.full(number,8.711128),np.full(number,45.62712)
+    X,Y = np.full(number,np.nan),np.full(number,np.nan)
+    for nil in np.unique(group_nil):
+        where = np.flatnonzero(group_nil == nil)
+        if nil <= 100:
+            if pools is not None:
+                pool = pools[int(nil)]
+                points = pool[rng.integers(0,pool.shape[0],len(where))]
+                lon[where],lat[where],X[where],Y[where] = points.T
             else:
-                if f_type == "LEG":
-                    bags = weighted_choice(75) # 55 percent checks bags
-                else:
-                    bags = weighted_choice(33) # 55 percent checks bags
-
-            if flag == 'departures':
-                if schengen:
-                    passport = False
-                else:
-                    passport = True
-                dep_time = int(idx.split("|")[2])                
-                self_service =  weighted_choice(15)
-                users.append([lat,lon,X,Y,u,random.randrange((cluster-1)*30,cluster*30),idx,dep_time,choice[counter],gate,passport,bags,self_service])
-            else:
-                arr_time = int(idx.split("|")[2])     
-                car =   weighted_choice(55)
-                users.append([lat,lon,X,Y,u,arr_time,idx,arr_time,choice[counter],gate,passport,bags,car])
-                
-            counter+=u
+                poly = polygons[polygons["ID_NIL"]==nil]['geometry'].values[0]
+                points = np.array(generate_random_coordinates(len(where),poly))
+                lon[where],lat[where] = points[:,0],points[:,1]
+        elif nil <= 200:
+            central_point = varese_pop[varese_pop["NIL"]==nil][['lat','lon']].values[0]
+            lon[where],lat[where] = rand_coords_within_circle(central_point[0],central_point[1],3000,len(where),rng)
+
+    # UTM coordinates for the points that are not taken from the pools
+    missing = np.isnan(X)
+    if missing.any():
+        X[missing],Y[missing],_,_ = utm.from_latlon(lat[missing],lon[missing])
+
+    # Non-Schengen passengers check bags more often, followed by legacy carriers
+    bag_perc = np.where(~schengen,80,np.where(f_types == "LEG",75,33))[group_flight]
+    bags = rng.integers(0,100,number) < bag_perc
+    passport = ~schengen[group_flight]
+
+    if flag == 'departures':
+        activation = rng.integers((cluster-1)*30,cluster*30,number)
+        self_service = rng.integers(0,100,number) < 15
+        user_df = pd.DataFrame({"lat":lat,"lon":lon,'X':X,'Y':Y,'no_persons':group_sizes,'activation_time':activation,
+                                'flight':codes[group_flight],'departure':times[group_flight],'NIL_ID':group_nil,
+                                'Gate':gates[group_flight],'Passport':passport,'Bags':bags,'Self-Check':self_service})
+    else:
+        # Passengers leave the terminal after disembarking, passport control and baggage claim; those of late flights
+        # leave in the last minute of the day at most, since the simulation does not run past it
+        car = rng.integers(0,100,number) < 55
+        activation = np.minimum(times[group_flight] + rng.integers(10,20,number) + 10*passport + 15*bags,1439)
+        user_df = pd.DataFrame({"lat":lat,"lon":lon,'X':X,'Y':Y,'no_persons':group_sizes,'activation_time':activation,
+                                'flight':codes[group_flight],'arrival':times[group_flight],'NIL_ID':group_nil,
+                                'Gate':gates[group_flight],'Passport':passport,'Bags':bags,'Car':car})
 
     # Examined Month
     m = int(date.split("-")[1])
 
     # Create a new directory because it does not exist
     path = f"data/passengers/{calendar.month_name[m]}/{date}"
-    isExist = os.path.exists(path)
-    if not isExist:
-        os.makedirs(path)
+    os.makedirs(path,exist_ok=True)
 
     
     if flag == 'departures':
-        user_df = pd.DataFrame(users,columns = ["lat","lon",'X','Y','no_persons','activation_time','flight','departure','NIL_ID','Gate','Passport','Bags','Self-Check'])
         if save:
             user_df.to_csv(f'{path}/pax_departures_{cluster}.csv',index=False)
     else:
-        user_df = pd.DataFrame(users,columns = ["lat","lon",'X','Y','no_persons','activation_time','flight','arrival','NIL_ID','Gate','Passport','Bags','Car'])
         if save:
             user_df.to_csv(f'{path}/pax_arrivals_{cluster}.csv',index=False)
     return user_df
@@ -0,0 +1,246 @@
+##################################################################### Demand Pregeneration ##################################################################
+
+import os
+import shutil
+import argparse
+import calendar
+from itertools import repeat
+from concurrent.futures import ProcessPoolExecutor
+import pandas as pd
+import numpy as np
+from Toolkit.demand_generation import *
+from Toolkit.data_bundle import load_data_bundle
+
+def get_demand_path(month_name,date_str,seed,flag='departures',scenario=''):
+
+    '''
+    Directory of the pregenerated demand for an examined date and seed:
+
+    Args:
+        month_name (str) : Examined month (Name)
+        date_str (str) : date in the (%d-%m-%YYYY) format
+        seed (int) : Seed that the demand was generated with
+        flag (str) : Either departures or arrivals
+        scenario (str) : Optional scenario folder of the examined date, see demand_scaler
+
+    Returns:
+        path (str): Directory holding one Parquet partition per cluster.
+
+    '''
+    return os.path.join(f"data/passengers/{month_name}/{date_str}",scenario,f"{flag}_seed_{seed}")
+
+def load_demand_inputs(date,flag='departures',scenario=''):
+
+    '''
+    Loads all data that demand generation depends on for an examined date:
+
+    Args:
+        date (str) : date in the (%YYYY-%m-%d) format, as given in the configuration
+        flag (str) : Either departures or arrivals
+        scenario (str) : Optional scenario folder of the examined date, see demand_scaler
+
+    Returns:
+        inputs (dict): Flight matrix and plan, population data, NIL polygons and their point pools.
+
+    '''
+    date = pd.Timestamp(date).date()
+    date_str = date.strftime('X%d/X%m/%Y').replace('X0','X').replace('X','').replace('/','-')
+    month_name = calendar.month_name[date.month]
+
+    data_folder = os.path.join(f"data/mxp/{month_name}/{date_str}",scenario,"")
+    inputs = {'date_str' : date_str,'month_name' : month_name}
+    inputs['passenger_data'] = pd.read_csv(data_folder + f"{flag}_matrix.csv", index_col=0)
+    inputs['flight_data'] = pd.read_csv(data_folder + f"{flag}_plan.csv")
+    inputs['flight_index'] = build_flight_index(inputs['flight_data'])
+    bundle = load_data_bundle()
+    inputs['pop_data'] = bundle['pop_data']
+    inputs['varese_pop'] = bundle['varese_pop']
+    inputs['polygons'] = bundle['polygons']
+    inputs['pools'] = load_point_pools(inputs['polygons'])
+    inputs['distribution'] = get_population_distribution(inputs['pop_data'],inputs['varese_pop'])
+    return inputs
+
+# Stream of every flag under the seed of the day; entropy (seed, 0) equals the plain seed, so departures keep their earlier streams
+FLAG_STREAMS = {'departures' : 0,'arrivals' : 1}
+
+def get_cluster_seeds(seed,clusters=48,flag='departures'):
+
+    '''
+    Independent random streams per cluster and flag, so that a cluster is the same regardless of the order or process it is generated in,
+    and arrivals are not correlated with the departures of the same cluster:
+
+    Args:
+        seed (int) : Seed of the examined day
+        clusters (int) : Amount of time-windows in the day
+        flag (str) : Either departures or arrivals
+
+    Returns:
+        seeds (dict): np.random.SeedSequence per cluster.
+
+    '''
+    return dict(zip(range(1,clusters+1),np.random.SeedSequence([seed,FLAG_STREAMS[flag]]).spawn(clusters)))
+
+def generate_cluster_demand(inputs,cluster,seed_seq,flag='departures'):
+
+    '''
+    Generates the trips of a single cluster:
+
+    Args:
+        inputs (dict) : Output of load_demand_inputs
+        cluster (int) : Examined time-window
+        seed_seq (np.random.SeedSequence) : Random stream of the cluster, see get_cluster_seeds
+        flag (str) : Either departures or arrivals
+
+    Returns:
+        user_df (pd.Dataframe): Output of demand_to_flight for the cluster.
+
+    '''
+    rng = np.random.default_rng(seed_seq)
+    demand = generate_passenger_demand(inputs['pop_data'],inputs['passenger_data'],str(cluster),inputs['date_str'],
+                                       inputs['varese_pop'],flag=flag,distribution=inputs['distribution'],rng=rng)
+    return demand_to_flight(inputs['date_str'],cluster,demand,inputs['passenger_data'],inputs['polygons'],
+                            inputs['varese_pop'],inputs['flight_data'],flag=flag,rng=rng,pools=inputs['pools'],
+                            flight_index=inputs['flight_index'])
+
+# Inputs of the worker processes, loaded once per process instead of being sent with every cluster
+_WORKER_INPUTS = {}
+
+def _init_worker(inputs):
+    _WORKER_INPUTS.update(inputs)
+
+def _generate_worker_cluster(cluster,seed_seq,flag):
+    return generate_cluster_demand(_WORKER_INPUTS,cluster,seed_seq,flag)
+
+def generate_day_demand(inputs,seed,flag='departures',clusters=range(1,49),workers=1):
+
+    '''
+    Generates the trips of every cluster of the examined date in one pass:
+
+    Args:
+        inputs (dict) : Output of load_demand_inputs
+        seed (int) : Seed of the examined day, the same seed reproduces the same day for any amount of workers
+        flag (str) : Either departures or arrivals
+        clusters (iterable) : Examined time-windows
+        workers (int) : Amount of processes generating clusters in parallel
+
+    Returns:
+        day_df (pd.Dataframe): Output of demand_to_flight for all clusters, with an extra cluster column.
+
+    '''
+    clusters = list(clusters)
+    seeds = get_cluster_seeds(seed,inputs['passenger_data'].shape[1],flag)
+    if workers > 1:
+        with ProcessPoolExecutor(workers,initializer=_init_worker,initargs=(inputs,)) as executor:
+            day = list(executor.map(_generate_worker_cluster,clusters,[seeds[x] for x in clusters],repeat(flag)))
+    else:
+        day = [generate_cluster_demand(inputs,x,seeds[x],flag) for x in clusters]
+
+    for cluster,user_df in zip(clusters,day):
+        user_df['cluster'] = cluster
+    return pd.concat(day,axis=0,ignore_index=True)
+
+class DemandPrefetcher:
+
+    '''
+    Generates the upcoming clusters in background processes while the current time-window is simulated.
+    A cluster is identical to the one generate_day_demand produces with the same seed.
+
+    Args:
+        inputs (dict) : Output of load_demand_inputs
+        seed (int) : Seed of the examined day
+        flag (str) : Either departures or arrivals
+        workers (int) : Amount of background processes
+        depth (int) : Amount of clusters generated ahead of the examined one
+
+    '''
+    def __init__(self,inputs,seed,flag='departures',workers=2,depth=2):
+        self.flag = flag
+        self.depth = depth
+        self.clusters = inputs['passenger_data'].shape[1]
+        self.seeds = get_cluster_seeds(seed,self.clusters,flag)
+        self.executor = ProcessPoolExecutor(workers,initializer=_init_worker,initargs=(inputs,))
+        self.pending = {}
+
+    def submit(self,cluster):
+        if 1 <= cluster <= self.clusters and cluster not in self.pending:
+            self.pending[cluster] = self.executor.submit(_generate_worker_cluster,cluster,self.seeds[cluster],self.flag)
+
+    def get(self,cluster):
+
+        '''
+        Returns the trips of the examined cluster and starts generating the following ones.
+        '''
+        self.submit(cluster)
+        for ahead in range(1,self.depth+1):
+            self.submit(cluster+ahead)
+        return self.pending.pop(cluster).result()
+
+    def close(self):
+        self.pending = {}
+        self.executor.shutdown(wait=False,cancel_futures=True)
+
+def write_day_demand(day_df,path):
+
+    '''
+    Stores the demand of a whole day as Parquet, partitioned by cluster; a previous run at the same path is replaced:
+
+    Args:
+        day_df (pd.Dataframe) : Output of generate_day_demand
+        path (str) : Output directory, see get_demand_path
+
+    '''
+    if os.path.exists(path):
+        shutil.rmtree(path)
+    day_df.to_parquet(path,partition_cols=['cluster'],index=False)
+
+def read_cluster_demand(path,cluster):
+
+    '''
+    Streams the trips of a single cluster from the pregenerated demand:
+
+    Args:
+        path (str) : Directory written by write_day_demand
+        cluster (int) : Examined time-window
+
+    Returns:
+        user_df (pd.Dataframe): Same columns as the output of demand_to_flight; empty if the cluster has no trips.
+
+    '''
+    user_df = pd.read_parquet(path,filters=[('cluster','==',cluster)])
+    return user_df.drop(columns='cluster').reset_index(drop=True)
+
+def pregenerate_demand(date,seed,flag='departures',workers=1,scenario=''):
+
+    '''
+    Generates and stores the demand of an examined date:
+
+    Args:
+        date (str) : date in the (%YYYY-%m-%d) format, as given in the configuration
+        seed (int) : Seed of the random generator
+        flag (str) : Either departures or arrivals
+        workers (int) : Amount of processes generating clusters in parallel
+        scenario (str) : Optional scenario folder of the examined date, see demand_scaler
+
+    Returns:
+        path (str): Directory of the stored demand.
+
+    '''
+    inputs = load_demand_inputs(date,flag,scenario)
+    day_df = generate_day_demand(inputs,seed,flag,workers=workers)
+    path = get_demand_path(inputs['month_name'],inputs['date_str'],seed,flag,scenario)
+    write_day_demand(day_df,path)
+    return path
+
+if __name__ == "__main__":
+
+    # Run from the repository root, e.g. python -m Toolkit.demand_pregeneration --date 2023-6-1 --seed 0
+    parser = argparse.ArgumentParser(description="Pregenerate passenger demand for a whole day")
+    parser.add_argument("--date", required=True, help="Examined date in the YYYY-M-D format")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the random generator")
+    parser.add_argument("--flag", choices=["departures","arrivals"], default="departures")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="Amount of processes generating clusters in parallel")
+    parser.add_argument("--scenario", default="", help="Scenario folder of the examined date, see Toolkit.demand_scaler")
+    args = parser.parse_args()
+
+    path = pregenerate_demand(args.date,args.seed,args.flag,args.workers,args.scenario)
+    print(f"Demand stored in {path}")
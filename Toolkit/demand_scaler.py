@@ -0,0 +1,135 @@
+##################################################################### Synthetic Demand Scaling ##################################################################
+
+import os
+import argparse
+import calendar
+import numpy as np
+import pandas as pd
+
+def shift_profiles(profiles,shift):
+
+    '''
+    Shifts the cluster profile of flights by a number of clusters; passengers shifted out of the day stay in its first or last cluster:
+
+    Args:
+        profiles (np.array) : Passengers per flight (rows) and cluster (columns)
+        shift (np.array) : Clusters that each row is shifted by (negative for earlier)
+
+    Returns:
+        shifted (np.array): Shifted profiles with the same total per row.
+
+    '''
+    n_clusters = profiles.shape[1]
+    source = np.arange(n_clusters)[None,:] - shift[:,None]
+    valid = (source >= 0) & (source < n_clusters)
+    shifted = np.where(valid,np.take_along_axis(profiles,np.clip(source,0,n_clusters-1),axis=1),0)
+
+    # Keep passengers that fall outside the day at its boundaries
+    lost = profiles.sum(axis=1) - shifted.sum(axis=1)
+    edge = np.where(shift > 0,n_clusters-1,0)
+    shifted[np.arange(len(shifted)),edge] += lost
+    return shifted
+
+def scale_flight_schedule(passenger_data,flight_data,factor,load=1.0,max_shift=1,jitter=10,flag='departures',rng=None):
+
+    '''
+    Generates a synthetic flight schedule with the schema of the <flag>_matrix.csv and <flag>_plan.csv files:
+
+    Args:
+        passenger_data (csv file): Dataframe read that should be stored in path data/mxp/<examined month (Name)>/<examined date (%d-%m-%YYYY)>/<flag>_matrix.csv
+        flight_data (csv file): Dataframe read that should be stored in path data/mxp/<examined month (Name)>/<examined date (%d-%m-%YYYY)>/<flag>_plan.csv
+        factor (float) : Expected amount of flights per original flight (e.g. 2, 5, 10); the fractional part is sampled
+        load (float) : Multiplier of the passengers per flight
+        max_shift (int) : Maximum amount of clusters that the time of an additional flight is shifted by
+        jitter (int) : Maximum amount of minutes added to the time of an additional flight on top of its shift
+        flag (str) : Either departures or arrivals
+        rng (np.random.Generator or int) : Optional random generator (or seed)
+
+    Returns:
+        passenger_data (pd.Dataframe): Passengers per flight and cluster of the synthetic schedule.
+        flight_data (pd.Dataframe): Plan of the synthetic schedule; additional flights get new flight codes.
+
+    '''
+    rng = np.random.default_rng(rng)
+    time_col,cluster_col = ('Departure Time (min)','Departure Cluster') if flag == 'departures' else ('Arrival Time (min)','Arrival Cluster')
+
+    plan = flight_data.drop_duplicates('Flight Code').set_index('Flight Code').reindex(passenger_data.index)
+    codes = passenger_data.index.to_numpy()
+    profiles = passenger_data.to_numpy()
+
+    # Copies per original flight, the first copy keeps the original flight
+    copies = np.floor(factor).astype(int) + (rng.random(len(codes)) < factor-np.floor(factor))
+    source = np.repeat(np.arange(len(codes)),copies)
+    copy = np.arange(len(source)) - np.repeat(np.cumsum(copies)-copies,copies)
+    extra = copy > 0
+
+    # Additional flights are moved by whole clusters and jittered by some minutes
+    shift = np.where(extra,rng.integers(-max_shift,max_shift+1,len(source)),0)
+    original = np.array([int(x.split("|")[2]) for x in codes],dtype=int)[source]
+    times = np.where(extra,np.clip(original + 30*shift + rng.integers(-jitter,jitter+1,len(source)),0,24*60-1),original)
+    shift = times//30 - original//30
+
+    new_profiles = np.round(shift_profiles(profiles[source],shift)*load)
+    new_codes = np.array([x if c == 0 else "|".join(x.split("|")[0:2] + [str(t)] + [f"{x.split('|')[3]}S{c}"])
+                          for x,c,t in zip(codes[source],copy,times)])
+
+    passenger_data = pd.DataFrame(new_profiles,index=new_codes,columns=passenger_data.columns)
+
+    flight_data = plan.iloc[source].reset_index(drop=True)
+    flight_data.insert(0,'Flight Code',new_codes)
+    flight_data['Pax'] = new_profiles.sum(axis=1).astype(int)
+    flight_data[time_col] = times.astype(float)
+    flight_data[cluster_col] = (times//30).astype(float)
+    if 'Departure Mu' in flight_data.columns:
+        flight_data['Departure Mu'] = flight_data['Departure Mu'] + shift
+    flight_data['index'] = np.arange(len(flight_data))
+
+    # Keep the plan ordered by time as the original files
+    order = np.argsort(times,kind='stable')
+    return passenger_data.iloc[order],flight_data.iloc[order].reset_index(drop=True)
+
+def write_scenario(date,factor,load=1.0,seed=0,scenario=None):
+
+    '''
+    Writes a scaled copy of the departures and arrivals of an examined date as a scenario folder that the model can load:
+
+    Args:
+        date (str) : date in the (%YYYY-%m-%d) format, as given in the configuration
+        factor (float) : Expected amount of flights per original flight
+        load (float) : Multiplier of the passengers per flight
+        seed (int) : Seed of the random generator
+        scenario (str) : Name of the scenario folder; defaults to scale_<factor>
+
+    Returns:
+        path (str): Folder of the scenario, i.e. data/mxp/<examined month (Name)>/<examined date (%d-%m-%YYYY)>/<scenario>
+
+    '''
+    date = pd.Timestamp(date).date()
+    date_str = date.strftime('X%d/X%m/%Y').replace('X0','X').replace('X','').replace('/','-')
+    data_folder = f"data/mxp/{calendar.month_name[date.month]}/{date_str}"
+    scenario = scenario if scenario != None else f"scale_{factor:g}"
+    path = f"{data_folder}/{scenario}"
+    os.makedirs(path,exist_ok=True)
+
+    rng = np.random.default_rng(seed)
+    for flag in ['departures','arrivals']:
+        passenger_data = pd.read_csv(f"{data_folder}/{flag}_matrix.csv",index_col=0)
+        flight_data = pd.read_csv(f"{data_folder}/{flag}_plan.csv")
+        passenger_data,flight_data = scale_flight_schedule(passenger_data,flight_data,factor,load,flag=flag,rng=rng)
+        passenger_data.to_csv(f"{path}/{flag}_matrix.csv")
+        flight_data.to_csv(f"{path}/{flag}_plan.csv",index=False)
+    return path
+
+if __name__ == "__main__":
+
+    # Run from the repository root, e.g. python -m Toolkit.demand_scaler --dates 2023-6-1 2023-6-2 --factor 5
+    parser = argparse.ArgumentParser(description="Scale the flight schedule of examined dates for stress testing")
+    parser.add_argument("--dates", nargs="+", required=True, help="Examined dates in the YYYY-M-D format")
+    parser.add_argument("--factor", type=float, required=True, help="Expected amount of flights per original flight")
+    parser.add_argument("--load", type=float, default=1.0, help="Multiplier of the passengers per flight")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the random generator")
+    parser.add_argument("--scenario", default=None, help="Name of the scenario folder (default scale_<factor>)")
+    args = parser.parse_args()
+
+    for date in args.dates:
+        print(f"Scenario stored in {write_scenario(date,args.factor,args.load,args.seed,args.scenario)}")
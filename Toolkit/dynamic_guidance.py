@@ -2,6 +2,7 @@
 
 import pandas as pd
 import polyline
+from openrouteservice.exceptions import ApiError,HTTPError,Timeout
 from Toolkit.network_represenentations import isolate_route,weighted_choice
 from TransitRouting.raptor import raptor
 import random
@@ -29,13 +30,15 @@ def return_car_route(client,coords,radius,disruption = []):
 
 def get_road_route(client,origin,destination,disruption):
     '''
-    Returns optimal route based on existing network status
+    Returns optimal route based on existing network status.
+    A single request with alternative routes is issued and the time-dependent speed layer corrects the
+    travel times of every alternative; closed road sections are avoided by the router.
 
     Args:
         client (openrouteservice.client) : The loaded local instance of the ORS router
         origin (list): Starting position for the route in the (long,lat) format
         destination (list) : Finishing position for the route in the (long,lat) format
-        disruption (dict) : Disruption affecting the examined route
+        disruption (dict) : State of the speed layer (RoadSpeedProfile.at) for the examined minute
 
     Returns:
         route (dict) : openrouteservice request
@@ -46,34 +49,40 @@ def get_road_route(client,origin,destination,disruption):
                     'profile': 'driving-car',
                     'preference': 'recommended',
                     'attributes' : ['avgspeed'],
-                    'instructions': True}
-    
-    base_route = client.directions(**request_params)
-    request_params['options'] = {'avoid_polygons': disruption['avoid_polygon']}
-    avoid_route = client.directions(**request_params)   
+                    'instructions': True,
+                    'alternative_routes': {'target_count': 3, 'weight_factor': 1.6}}
 
-    if  disruption['perc_road'] == 0 :
-        return base_route
-    
-    if disruption['slow_down'] == False:
+    if disruption['avoid_polygon'] != None:
         request_params['options'] = {'avoid_polygons': disruption['avoid_polygon']}
-        avoid_route = client.directions(**request_params)   
-        return avoid_route
-    
-    if disruption['slow_down'] == True:
-        slow_route = base_route
-        segments = base_route['features'][0]['properties']['segments'][0]['steps']
-        for edge in segments:
-            if edge['name'] in disruption['edges_speed'].keys():
-                edge['duration'] = disruption['edges_speed'][edge['name']]
-        
-        slow_route['features'][0]['properties']['segments'][0]['steps'] = segments
-        slow_route['features'][0]['properties']['summary']['duration'] = sum([x['duration'] for x in segments])
+    route = client.directions(**request_params)
 
-        if slow_route['features'][0]['properties']['summary']['duration'] < avoid_route['features'][0]['properties']['summary']['duration']:
-            return slow_route
-        else:
-            return avoid_route
+    # Keep the fastest alternative under the current speeds
+    durations = [disruption['profile'].apply(x,disruption['minute']) for x in route['features']]
+    route['features'] = [route['features'][int(np.argmin(durations))]]
+    return route
+
+def first_mile_times(model,agent,disruption=[]):
+    '''
+    Returns the car travel times from the origin of an agent to all transit points of the model.
+    Times are read from the precomputed first mile matrix and only requested from ORS for unknown origins.
+
+    Args:
+        model (mesa.Model) : The simulation model.
+        agent (mesa.Agent) : The examined Passenger.
+        disruption (dict) : Disruption affecting the examined routes (only for unknown origins)
+
+    Returns:
+        times (np.array) : Travel times in minutes, ordered as model.transit_nodes
+    '''
+    times = model.first_mile_times.get(int(agent.NIL))
+    if times is None:
+        times = []
+        for tr in model.transit_nodes.keys():
+            coords = (agent.lonlat,model.transit_nodes[tr]['lonlat'])
+            CAR_ROUTE_TRANS = return_car_route(model.client,coords,250,disruption)
+            times.append(CAR_ROUTE_TRANS['routes'][0]['summary']['duration']/60 if CAR_ROUTE_TRANS != None else np.inf)
+        times = np.array(times)
+    return times
 
 def get_route_to_list(route):
     '''
@@ -90,34 +99,96 @@ def get_route_to_list(route):
     loc = [(x[1],x[0]) for x in loc]
     return loc
 
+def route_approach(CAR_ROUTE,destination,tolerance=2.5e-3):
+    '''
+    Defines the side (NORTH/SOUTH) from which a car route approaches its destination.
+    The route approaches from the south when it never passes north of the destination, which is read
+    from the bounding box of the route instead of decoding the full polyline.
+
+    Args:
+        CAR_ROUTE (dict) : openrouteservice request (json or geojson format)
+        destination (tuple) : Destination of the route in the (long,lat) format
+        tolerance (float) : Allowed offset (degrees) between the destination and its snapped position on the road
+
+    Returns:
+        approach (str) : NORTH or SOUTH
+    '''
+    if 'features' in CAR_ROUTE:
+        bbox = CAR_ROUTE['features'][0].get('bbox',CAR_ROUTE.get('bbox'))
+    else:
+        bbox = CAR_ROUTE['routes'][0].get('bbox')
+
+    if bbox is not None:
+        # bbox is [min_lon,min_lat,(min_ele),max_lon,max_lat,(max_ele)]
+        max_lat = bbox[len(bbox)//2 + 1]
+        south = max_lat <= destination[1] + tolerance
+    else:
+        if 'features' in CAR_ROUTE:
+            pl = [x[1] for x in CAR_ROUTE['features'][0]['geometry']['coordinates']]
+        else:
+            pl = [x[0] for x in polyline.decode(CAR_ROUTE['routes'][0]['geometry'])]
+        south = max(pl) == pl[-1]
+
+    if south:
+        return "SOUTH"
+    return "NORTH"
+
+def summarize_car_route(CAR_ROUTE,destination):
+    '''
+    Stores the duration, distance and approach of a car route in its summary, so that they are derived once per route.
+
+    Args:
+        CAR_ROUTE (dict) : openrouteservice request
+        destination (tuple) : Destination of the route in the (long,lat) format
+
+    Returns:
+        summary (dict) : Summary of the route with the duration (sec), distance (m) and approach
+    '''
+    summary = CAR_ROUTE['routes'][0]['summary']
+    if 'approach' not in summary:
+        summary['approach'] = route_approach(CAR_ROUTE,destination)
+    return summary
+
+def car_KPIS(duration,distance,activation,departure,taxi,noise=None):
+    '''
+    Computes the car KPIs for a group of agents (e.g. a whole cluster) as array operations.
+
+    Args:
+        duration (np.array) : Duration of the car routes in seconds
+        distance (np.array) : Distance of the car routes in meters
+        activation (np.array) : Time (minutes from midnight) that the trips start
+        departure (np.array) : Time (minutes from midnight) that the associated flights depart
+        taxi (np.array) : Flags for trips that are carried out by taxi
+        noise (np.array) : Extra minutes spent parking / dropping off; sampled uniformly from 1 to 9 if not given
+
+    Returns:
+        travel_time (np.array) : Travel time by car in minutes
+        distance (np.array) : Distance by car in km
+        safety_margin (np.array) : Safety margin between airport arrival and flight departure in minutes
+        drop_off (np.array) : Flags for trips that are drop-offs
+    '''
+    duration = np.asarray(duration,dtype=float)
+    if noise is None:
+        noise = np.random.randint(1,10,size=duration.shape)
+
+    travel_time = duration/60 + noise
+    safety_margin = np.asarray(departure) - (np.asarray(activation) + travel_time)
+    drop_off = np.asarray(taxi,dtype=bool) | (np.random.random(duration.shape) < 0.5)
+    return travel_time,np.asarray(distance)//1000,safety_margin,drop_off
+
 def extract_KPIS(model,agent,mode,CAR_ROUTE,D_TIME,TRANS_ROUTE=None,TRANSFERS=None):
 
     if mode == "CAR" or mode == "TAXI":
-        pl = []
-        if model.active_road_disruption != []:
-            pl = CAR_ROUTE['features'][0]['geometry']['coordinates']
-        
-        # Compute Travel Time and Distance by Car 
-        agent.TRAVEL_TIME_CAR = CAR_ROUTE['routes'][0]['summary']['duration']/60 + np.random.randint(1,10)
-        agent.DISTANCE_CAR = CAR_ROUTE['routes'][0]['summary']['distance']//1000
-
-        # Define Approach of Car route
-        if pl == []:
-            pl = polyline.decode(CAR_ROUTE['routes'][0]['geometry'])
-            pl = [x[0] for x in pl]
-        if max(pl) == pl[-1]:
-            agent.APPROACH = "SOUTH"
-        else:
-            agent.APPROACH = "NORTH"
 
-        # Compute Safety Margin, Start of Trip and 
-        agent.SAFETY_MARGIN_CAR =  agent.departure - (agent.activation + agent.TRAVEL_TIME_CAR)
-        
-        # Determine if trip is a drop-off
-        if mode == "TAXI":
-            agent.DROP_OFF_CAR = True
-        else:
-            agent.DROP_OFF_CAR = weighted_choice(50)
+        # Compute Travel Time, Distance, Safety Margin and drop-off from the route summary
+        summary = summarize_car_route(CAR_ROUTE,model.mxp_lonlat)
+        travel_time,distance,safety_margin,drop_off = car_KPIS(summary['duration'],summary['distance'],
+                                                             agent.activation,agent.departure,mode == "TAXI")
+        agent.TRAVEL_TIME_CAR = float(travel_time)
+        agent.DISTANCE_CAR = float(distance)
+        agent.SAFETY_MARGIN_CAR = float(safety_margin)
+        agent.DROP_OFF_CAR = bool(drop_off)
+        agent.APPROACH = summary['approach']
         agent.BOARD_TIME_STAMP = None
         
     else:
@@ -226,22 +297,15 @@ def assign(agent,model):
             if np.random.random() < float(model.args.modal_split_coach) + float(model.args.modal_split_train):
 
                 # Determine potential Transit Points to access via car or taxi
-                CAR_FIRST_MILES = []    
-                for tr in model.transit_nodes.keys():
-                    coords = (agent.lonlat,model.transit_nodes[tr]['lonlat'])
-                    CAR_ROUTE_TRANS = return_car_route(model.client,coords,250,[])
-                    CAR_TIME_TRANS = CAR_ROUTE_TRANS['routes'][0]['summary']['duration']/60
-                    CAR_FIRST_MILES.append(CAR_TIME_TRANS)
-
-                # Isolate best three
-                BEST_TRANSIT = sorted(range(len(CAR_FIRST_MILES)), key=lambda k: CAR_FIRST_MILES[k])
-                BEST_TRANSIT = [list(model.transit_nodes.keys())[x] for x in BEST_TRANSIT]
+                CAR_FIRST_MILES = first_mile_times(model,agent)
+
+                # Isolate closest transit point of the chosen mode
                 if np.random.random()<0.5:
-                    BEST_TRANSIT = [x for x in BEST_TRANSIT if model.transit_nodes[x]['mode'] == "TRAIN"][0]
                     mode = "TRAIN"
                 else:
-                    BEST_TRANSIT = [x for x in BEST_TRANSIT if model.transit_nodes[x]['mode'] == "COACH"][0]
                     mode = "COACH"
+                candidates = np.flatnonzero(model.transit_modes == mode)
+                BEST_TRANSIT = model.transit_names[candidates[np.argmin(CAR_FIRST_MILES[candidates])]]
                 S_TIME_PT,E_TIME_PT,TRANSFERS,TRANS_ROUTE = raptor(model.transit_nodes[BEST_TRANSIT]['stop_id'],model.transit_nodes[BEST_TRANSIT]['mxp_node'],D_TIME,1,model.change_time,
                 model.routes_by_stop_dict,model.stops_dict,model.stoptimes_dict,model.footpath_dict,
                 model.idx_by_route_stop_dict)
@@ -303,16 +367,23 @@ def assign(agent,model):
                     BEST_TRANSITS = []
 
                     # Determine potential Transit Points to access via car or taxi    
-                    for tr in model.transit_nodes.keys():
-                        coords = (agent.lonlat,model.transit_nodes[tr]['lonlat'])
-                        CAR_ROUTE_TRANS = return_car_route(model.client,coords,250,model.active_road_disruption)
-                        CAR_TIME_TRANS = CAR_ROUTE_TRANS['routes'][0]['summary']['duration']/60
-                        CAR_FIRST_MILES.append(CAR_TIME_TRANS)
+                    times = first_mile_times(model,agent,model.active_road_disruption)
 
                     # Isolate best three
-                    BEST_TRANSIT = sorted(range(len(CAR_FIRST_MILES)), key=lambda k: CAR_FIRST_MILES[k])[0:3]
-                    BEST_TRANSIT = [list(model.transit_nodes.keys())[x] for x in BEST_TRANSIT]
-                    CAR_FIRST_MILES = sorted(CAR_FIRST_MILES)[0:3]
+                    k = min(3,len(times))
+                    BEST = np.argpartition(times,k-1)[0:k]
+
+                    # Re-evaluate the shortlisted transit points under an active road disruption
+                    if model.active_road_disruption != []:
+                        times = times.copy()
+                        for x in BEST:
+                            coords = (agent.lonlat,model.transit_nodes[model.transit_names[x]]['lonlat'])
+                            CAR_ROUTE_TRANS = return_car_route(model.client,coords,250,model.active_road_disruption)
+                            if CAR_ROUTE_TRANS != None:
+                                times[x] = CAR_ROUTE_TRANS['routes'][0]['summary']['duration']/60
+                    BEST = BEST[np.argsort(times[BEST])]
+                    BEST_TRANSIT = [model.transit_names[x] for x in BEST]
+                    CAR_FIRST_MILES = times[BEST].tolist()
                     
                     # Initalize upper bounds  
                     BEST_MIXED = pd.Timestamp(year=model.date.year,month=model.date.month+1,day=model.date.day)
@@ -390,6 +461,107 @@ def reassign(agent, station, model):
     agent.TRANSFERS+=1
     agent.ARR_TIME = agent.E_TIME.hour * 60 + agent.E_TIME.minute
 
+def arrival_car_times(model,agents):
+    '''
+    Returns the car travel times from MXP to the destination of a batch of arriving passengers.
+    Without a road disruption the whole batch is timed with a single matrix request; if the router rejects it,
+    every passenger is routed on their own as under a disruption.
+
+    Args:
+        model (mesa.Model) : The simulation model.
+        agents (list) : Arriving Passengers leaving by car or taxi.
+
+    Returns:
+        durations (np.array) : Travel times in minutes; NaN when no route is found
+        distances (np.array) : Travel distances in km; NaN when no route is found
+    '''
+    durations,distances = np.full(len(agents),np.nan),np.full(len(agents),np.nan)
+    if len(agents) == 0:
+        return durations,distances
+
+    if model.active_road_disruption == []:
+        try:
+            matrix = model.client.distance_matrix(locations=[model.mxp_lonlat]+[agent.lonlat for agent in agents],
+                                                  sources=[0],destinations=list(range(1,len(agents)+1)),
+                                                  metrics=['duration','distance'],profile='driving-car')
+            durations = np.array(matrix['durations'][0],dtype=float)/60
+            distances = np.array(matrix['distances'][0],dtype=float)/1000
+            return durations,distances
+        except (ApiError,HTTPError,Timeout) as e:
+            print(f"ORS matrix request failed ({type(e).__name__}: {e}) - routing {len(agents)} arriving passengers one by one")
+
+    # NaN is kept only where no route exists
+    for idx,agent in enumerate(agents):
+        CAR_ROUTE = return_car_route(model.client,(model.mxp_lonlat,agent.lonlat),250,model.active_road_disruption)
+        if CAR_ROUTE != None:
+            durations[idx] = CAR_ROUTE['routes'][0]['summary']['duration']/60
+            distances[idx] = CAR_ROUTE['routes'][0]['summary']['distance']/1000
+    return durations,distances
+
+def assign_arrivals(agents,model):
+    '''
+    Determine the trip from MXP towards the destination of arriving Passengers activated in the current step.
+    Car trips are timed as one batch and passengers heading to the same station by the same mode share a single RAPTOR query.
+
+    :param agents: Arriving Passengers activated in the current step.
+    :param model: The simulation model.
+    '''
+    D_TIME = pd.Timestamp(year=model.date.year,month=model.date.month,day=model.date.day,
+                    hour =model.schedule.steps//60,
+                    minute=model.schedule.steps%60)
+    pt_share = float(model.args.modal_split_train)/max(float(model.args.modal_split_train)+float(model.args.modal_split_coach),1e-9)
+    taxi_share = float(model.args.modal_split_taxi)/max(float(model.args.modal_split_taxi)+float(model.args.modal_split_car),1e-9)
+
+    road,journeys = [],{}
+    for agent in agents:
+        agent.S_TIME = D_TIME
+
+        # Passengers staying around the airport do not load the network
+        if agent.lonlat == model.mxp_lonlat:
+            agent.E_TIME = D_TIME
+            agent.TRAVEL_TIME = 0
+            continue
+
+        # Closest station within the walking radius of the destination
+        close_stations = agent.get_stations()
+        if agent.car or close_stations == []:
+            road.append(agent)
+            continue
+        walking_time = agent.calculate_time_to_station(close_stations)
+        station = close_stations[int(np.argmin(walking_time))]
+
+        mode = "TRAIN" if np.random.random() < pt_share else "COACH"
+        key = (mode,station.unique_id)
+        if key not in journeys:
+            journeys[key] = raptor(model.modes[mode][1],station.unique_id,D_TIME + model.CH_DELTA,agent.max_transfer,model.change_time,
+                                   model.routes_by_stop_dict,model.stops_dict,model.stoptimes_dict,model.footpath_dict,
+                                   model.idx_by_route_stop_dict)
+        S_TIME_PT,E_TIME_PT,TRANSFERS,TRANS_ROUTE = journeys[key]
+        if TRANS_ROUTE == None:
+            road.append(agent)
+            continue
+
+        # The first line boarded at MXP is the one loaded by the passenger
+        first_leg = [leg for leg in TRANS_ROUTE if leg[0] != "walking"][0]
+        agent.MODE = mode
+        agent.LINE_USED = first_leg[-1]
+        agent.BOARD_TIME = first_leg[0].hour * 60 + first_leg[0].minute
+        agent.TRANSIT_STATION = station.unique_id
+        agent.TRANSIT_STATION_NAME = station.name
+        agent.TRANSFERS = TRANSFERS-1
+        agent.WALK_TIME = walking_time[int(np.argmin(walking_time))]
+        agent.E_TIME = E_TIME_PT + pd.Timedelta(minutes=agent.WALK_TIME)
+        agent.TRAVEL_TIME = (agent.E_TIME-D_TIME).total_seconds()/60
+
+    # Remaining passengers are picked up by car or taxi
+    durations,distances = arrival_car_times(model,road)
+    for agent,duration,distance in zip(road,durations,distances):
+        agent.MODE = "TAXI" if np.random.random() < taxi_share else "CAR"
+        agent.LINE_USED = "None"
+        agent.TRAVEL_TIME = duration if not np.isnan(duration) else random.uniform(30, 60)
+        agent.DISTANCE_CAR = None if np.isnan(distance) else distance
+        agent.E_TIME = D_TIME + pd.Timedelta(minutes=agent.TRAVEL_TIME).ceil("T")
+
 def initial_state(model,pass_distr):
     '''
     Initialize agents at the airport prior to simulation start
@@ -0,0 +1,76 @@
+##################################################################### Flight and Gate Index ##################################################################
+
+import numpy as np
+
+class FlightRecord:
+
+    '''
+    Metadata of a single flight of the examined date.
+    '''
+    __slots__ = ('code','gate','time','schengen','f_type','passport')
+
+    def __init__(self,code,gate,time,schengen,f_type,passport):
+        self.code = code
+        self.gate = gate
+        self.time = time
+        self.schengen = schengen
+        self.f_type = f_type
+        self.passport = passport
+
+class GateRecord:
+
+    '''
+    Check-in area of a gate and walking times towards it from the car and train arrival points.
+    '''
+    __slots__ = ('gate','check_in','time_car','time_train')
+
+    def __init__(self,gate,check_in,time_car,time_train):
+        self.gate = gate
+        self.check_in = check_in
+        self.time_car = time_car
+        self.time_train = time_train
+
+def build_flight_index(flight_data):
+
+    '''
+    Builds the flight metadata index of an examined date once, so that hot paths avoid pandas label lookups:
+
+    Args:
+        flight_data (csv file): Dataframe read that should be stored in path data/mxp/<examined month (Name)>/<examined date (%d-%m-%YYYY)>/<flag>_plan.csv;
+                                derived from flights_to_demand.ipynb
+
+    Returns:
+        index (dict): FlightRecord per flight code.
+
+    '''
+    flight_data = flight_data.drop_duplicates('Flight Code')
+    codes = flight_data['Flight Code'].to_numpy()
+    gates = flight_data['Gate'].to_numpy()
+    passport = flight_data['Passport'].to_numpy(dtype=bool)
+
+    # Arrival plans carry no flight type, the Passport flag stands in for the Schengen area
+    if 'SCHENGEN' in flight_data.columns:
+        schengen = flight_data['SCHENGEN'].to_numpy(dtype=bool)
+        f_types = flight_data['TYPE'].to_numpy()
+    else:
+        schengen = ~passport
+        f_types = np.full(len(codes),"")
+
+    return {c : FlightRecord(c,int(g),int(c.split("|")[2]),bool(s),t,bool(p))
+            for c,g,s,t,p in zip(codes,gates,schengen,f_types,passport)}
+
+def build_gate_index(arr_to_check):
+
+    '''
+    Builds the gate index once, so that hot paths avoid pandas label lookups:
+
+    Args:
+        arr_to_check (xlsx file): Dataframe read from data/mxp/arr_to_checkin.xlsx, indexed by gate
+
+    Returns:
+        index (dict): GateRecord per gate; check_in is the name of the check-in queue (e.g. C3).
+
+    '''
+    return {int(g) : GateRecord(int(g),f"C{int(c)}",float(car),float(train))
+            for g,c,car,train in zip(arr_to_check.index,arr_to_check['Check-in'],
+                                     arr_to_check['Time Car (min)'],arr_to_check['Time Train (min)'])}
@@ -0,0 +1,202 @@
+##################################################################### Flight Schedule Ingestion ##################################################################
+
+import os
+import argparse
+import calendar
+import numpy as np
+import pandas as pd
+from scipy.special import ndtr
+
+def read_flight_schedule(data_path='data/mxp/mxp_data.csv',airlines_path='data/mxp/airlines.xlsx',year=2023,period=30,trip_start=210,rng=None):
+
+    '''
+    Ingests the flight level export of MXP once and derives the characteristics of every flight in a single vectorized pass:
+
+    Args:
+        data_path (str) : Arrivals/departures of MXP (Time, Date, Pax, Type, Company)
+        airlines_path (str) : ICAO code, type and Schengen flag of every airline
+        year (int) : Year that the schedule is assigned to
+        period (int) : Length of time-windows in minutes
+        trip_start (int) : Minutes in advance of their flight that most passengers start their trip to the airport
+        rng (np.random.Generator or int) : Optional random generator (or seed)
+
+    Returns:
+        flights (pd.Dataframe): One row per flight with Flight Code, Date, Company, Pax, Type (A/D), Time (min), Cluster, Mu, SCHENGEN, TYPE and NATIONAL.
+
+    '''
+    rng = np.random.default_rng(rng)
+    data = pd.read_csv(data_path,encoding='utf-8-sig')
+    airlines = pd.read_excel(airlines_path).drop_duplicates('Airline').set_index('Airline')
+    meta = airlines.reindex(data['Company'])
+
+    # Departure time is written in the HHMM format without ':'
+    minutes = (data['Time']//100*60 + data['Time']%100).to_numpy()
+    cluster = minutes//period
+    date = pd.to_datetime(data['Date'],format='%d/%m/%Y')
+    day = date.dt.day.to_numpy()
+
+    # Specialized code based on Airline|Day|Time|Random ID
+    codes = meta['ICAO'].to_numpy().astype(str) + '|' + day.astype(str) + '|' + minutes.astype(str) + '|' + \
+            data['Type'].to_numpy().astype(str) + (np.arange(len(data))%100).astype(str)
+
+    # Schengen area and national routes are sampled per airline type
+    f_type = meta['TYPE'].to_numpy()
+    u = rng.random((3,len(data)))
+    schengen = (meta['SCHENGEN'].to_numpy() != 1) & (u[0] >= 0.15)
+    schengen &= ~((f_type == 'LEISURE') & (u[1] < 0.5))
+    national = schengen & np.select([f_type == 'LEISURE',f_type == 'LC',f_type == 'LEG'],[u[2] < 0.8,u[2] < 0.5,u[2] < 0.01],False)
+
+    # Time-window that the average passenger starts the trip towards the airport
+    mu = cluster - trip_start//period + ((f_type != 'LEG') | national) - 2*(~schengen)
+    mu = np.maximum(mu,0)
+
+    flights = pd.DataFrame({'Flight Code' : codes,'Date' : [f"{d.day}/{d.month}/{year}" for d in date],'Company' : data['Company'].to_numpy(),
+                            'Pax' : data['Pax'].to_numpy(),'Type' : data['Type'].to_numpy(),'Time (min)' : minutes,'Cluster' : cluster,
+                            'Mu' : mu,'SCHENGEN' : schengen,'TYPE' : f_type,'NATIONAL' : national,'day' : day})
+    return flights.sort_values(['day','Time (min)'],kind='stable')
+
+def assign_gates(n_flights,no_gates=72,shared=24,rng=None):
+
+    '''
+    Assigns gates to the flights of a day in chronological order; gates up to shared are reused, the rest once until only those remain:
+
+    Args:
+        n_flights (int) : Flights of the examined day
+        no_gates (int) : Gates of the terminal
+        shared (int) : Gates that can be used by several flights
+        rng (np.random.Generator or int) : Optional random generator (or seed)
+
+    Returns:
+        gates (np.array): Gate per flight.
+
+    '''
+    rng = np.random.default_rng(rng)
+    draws = rng.random(n_flights)
+    available = list(range(1,no_gates+1))
+    gates = np.empty(n_flights,dtype=int)
+    for idx in range(n_flights):
+        gate = available[int(draws[idx]*len(available))]
+        gates[idx] = gate
+        if gate > shared:
+            available.remove(gate)
+        if len(available) == shared:
+            available = list(range(1,no_gates+1))
+    return gates
+
+def departures_to_matrix(departures_plan,tot_periods=48,spread=1,rng=None):
+
+    '''
+    Spreads the passengers of every flight across the time-windows around its Departure Mu in one multinomial draw:
+
+    Args:
+        departures_plan (pd.Dataframe) : Departures of the examined day
+        tot_periods (int) : Time-windows of the day
+        spread (float) : Standard deviation of the trip start in time-windows
+        rng (np.random.Generator or int) : Optional random generator (or seed)
+
+    Returns:
+        matrix (pd.Dataframe): Passengers per flight (index) and time-window (columns 1..tot_periods).
+
+    '''
+    rng = np.random.default_rng(rng)
+    mu = departures_plan['Departure Mu'].to_numpy(dtype=float)[:,None]
+    edges = np.arange(tot_periods+1)[None,:] - 0.5
+
+    # Probability that a rounded normal around mu falls in each window; tails are kept in the first and last window
+    cdf = ndtr((edges-mu)/spread)
+    cdf[:,0],cdf[:,-1] = 0,1
+    probabilities = np.diff(cdf,axis=1)
+    counts = rng.multinomial(departures_plan['Pax'].to_numpy(dtype=np.int64),probabilities) if len(mu) else np.zeros((0,tot_periods))
+    return pd.DataFrame(counts.astype(float),index=departures_plan['Flight Code'].tolist(),columns=list(range(1,tot_periods+1)))
+
+def arrivals_to_matrix(arrivals_plan,tot_periods=48):
+
+    '''
+    Places the passengers of every arriving flight at its arrival time-window:
+
+    Args:
+        arrivals_plan (pd.Dataframe) : Arrivals of the examined day
+        tot_periods (int) : Time-windows of the day
+
+    Returns:
+        matrix (pd.Dataframe): Passengers per flight (index) and time-window (columns 1..tot_periods).
+
+    '''
+    counts = np.zeros((len(arrivals_plan),tot_periods))
+    counts[np.arange(len(arrivals_plan)),arrivals_plan['Arrival Cluster'].to_numpy(dtype=int)] = arrivals_plan['Pax'].to_numpy()
+    return pd.DataFrame(counts,index=arrivals_plan['Flight Code'].tolist(),columns=list(range(1,tot_periods+1)))
+
+def build_month(month=6,year=2023,days=None,output='data/mxp',seed=0,**kwargs):
+
+    '''
+    Emits the plans and matrices of all examined days of a month from a single ingestion of the flight schedule:
+
+    Args:
+        month (int) : Examined month
+        year (int) : Year that the schedule is assigned to
+        days (list) : Examined days; all days of the month if not given
+        output (str) : Folder that <examined month (Name)>/<examined date (%d-%m-%YYYY)> folders are written to
+        seed (int) : Seed of the random generator
+        **kwargs : Passed to read_flight_schedule
+
+    Returns:
+        paths (list): Folders of the written days.
+
+    '''
+    rng = np.random.default_rng(seed)
+    flights = read_flight_schedule(year=year,rng=rng,**kwargs)
+    if days != None:
+        flights = flights[flights['day'].isin(days)]
+
+    month_name = calendar.month_name[month]
+    os.makedirs(f"{output}/{month_name}",exist_ok=True)
+    is_departure = (flights['Type'] == 'D').to_numpy()
+
+    # Month level plans
+    departures = flights[is_departure].rename(columns={'Time (min)' : 'Departure Time (min)','Cluster' : 'Departure Cluster','Mu' : 'Departure Mu'})
+    arrivals = flights[~is_departure].rename(columns={'Time (min)' : 'Arrival Time (min)','Cluster' : 'Arrival Cluster'})
+    departures[['Departure Time (min)','Departure Cluster','Departure Mu','Flight Code','SCHENGEN','TYPE','NATIONAL','Date','Pax','Company']].to_csv(f"{output}/{month_name}/departures_plan.csv",index=False)
+    arrivals[['Arrival Time (min)','Arrival Cluster','Flight Code','Date','Pax','Company']].to_csv(f"{output}/{month_name}/arrivals_plan.csv",index=False)
+    pd.concat([departures,arrivals],axis=0).drop(columns=['Type','day']).to_csv(f"{output}/{month_name}/total_flights_plan.csv",index=False)
+
+    paths = []
+    for day,day_plan in flights.groupby('day',sort=True):
+
+        # Position of each flight in the day's plan (departures first), then chronological order for gate assignment
+        day_plan = pd.concat([day_plan[day_plan['Type'] == 'D'],day_plan[day_plan['Type'] == 'A']],axis=0)
+        day_plan['index'] = np.arange(len(day_plan))
+        day_plan = day_plan.sort_values(['Time (min)','SCHENGEN'],kind='stable')
+        day_plan['Gate'] = assign_gates(len(day_plan),rng=rng)
+
+        # Passport control is needed outside the Schengen area, which is only known for departures
+        day_plan['Passport'] = ((day_plan['Type'] == 'D') & ~day_plan['SCHENGEN']).astype(int)
+
+        departures_plan = day_plan[day_plan['Type'] == 'D'].rename(columns={'Time (min)' : 'Departure Time (min)','Cluster' : 'Departure Cluster','Mu' : 'Departure Mu'})
+        departures_plan = departures_plan[['Flight Code','Date','Company','Pax','Gate','Passport','Departure Time (min)','Departure Cluster','Departure Mu','index','SCHENGEN','TYPE','NATIONAL']]
+        departures_plan[['Departure Time (min)','Departure Cluster','Departure Mu']] = departures_plan[['Departure Time (min)','Departure Cluster','Departure Mu']].astype(float)
+        arrivals_plan = day_plan[day_plan['Type'] == 'A'].rename(columns={'Time (min)' : 'Arrival Time (min)','Cluster' : 'Arrival Cluster'})
+        arrivals_plan = arrivals_plan[['Flight Code','Date','Company','Pax','Gate','Passport','Arrival Time (min)','Arrival Cluster','index']]
+        arrivals_plan[['Arrival Time (min)','Arrival Cluster']] = arrivals_plan[['Arrival Time (min)','Arrival Cluster']].astype(float)
+
+        path = f"{output}/{month_name}/{day}-{month}-{year}"
+        os.makedirs(path,exist_ok=True)
+        departures_plan.to_csv(f"{path}/departures_plan.csv",index=False)
+        arrivals_plan.to_csv(f"{path}/arrivals_plan.csv",index=False)
+        departures_to_matrix(departures_plan,rng=rng).to_csv(f"{path}/departures_matrix.csv")
+        arrivals_to_matrix(arrivals_plan).to_csv(f"{path}/arrivals_matrix.csv")
+        paths.append(path)
+    return paths
+
+if __name__ == "__main__":
+
+    # Run from the repository root, e.g. python -m Toolkit.flight_ingestion --month 6 --year 2023
+    parser = argparse.ArgumentParser(description="Build per-date flight plans and matrices from the MXP flight schedule")
+    parser.add_argument("--month", type=int, default=6, help="Examined month")
+    parser.add_argument("--year", type=int, default=2023, help="Year that the schedule is assigned to")
+    parser.add_argument("--days", type=int, nargs="+", default=None, help="Examined days (default all days of the month)")
+    parser.add_argument("--output", default="data/mxp", help="Output folder")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the random generator")
+    args = parser.parse_args()
+
+    paths = build_month(args.month,args.year,args.days,args.output,args.seed)
+    print(f"{len(paths)} days written to {args.output}")
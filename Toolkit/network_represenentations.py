@@ -2,15 +2,18 @@
 
 import subprocess
 import requests
-from shapely.geometry import LineString,MultiLineString
+from shapely.geometry import LineString,MultiLineString,Polygon
+from shapely import contains_xy
 from shapely.ops import unary_union,linemerge
 import json
+import hashlib
 import geopandas as gpd
 import os
 import pandas as pd
 from pyproj import Geod
 import folium
 from time import sleep
+import time
 import webbrowser
 import random
 import numpy as np
@@ -18,22 +21,140 @@ import numpy as np
 def weighted_choice(percent=50):
     return random.randrange(100) < percent
 
-def open_ORS():
+def open_ORS(base_url='http://localhost:8080/ors',max_wait=1800,backoff=1,max_backoff=30):
     '''
     Process to turn on the OpenRouteService API
+
+    The health endpoint is polled with an exponential backoff, since ORS answers on its
+    base url long before the routing graphs are built.
+
+    Args:
+        base_url (str) : Url of the local instance of the ORS router
+        max_wait (int) : Maximum time (seconds) to wait for the router to become ready
+        backoff (float) : Initial waiting time (seconds) between two consecutive polls
+        max_backoff (float) : Upper bound of the waiting time (seconds) between two polls
+
+    Returns:
+        time_to_ready (float) : Time (seconds) needed until ORS was able to serve routes
     '''
     print("Started loading ORS")
     subprocess.Popen('wsl ~ docker compose -f ~/milano/docker-compose.yml up',stdout=subprocess.DEVNULL,stderr=subprocess.STDOUT, shell=True)
 
-    # Making a GET request to ensure that ORS is up
+    # Poll the health endpoint until the graphs are loaded
+    start = time.time()
     while True:
         try:
-            r = requests.get('http://localhost:8080/ors')
-            break
-        except:
+            r = requests.get(f'{base_url}/v2/health',timeout=5)
+            if r.status_code == 200 and r.json().get('status') == 'ready':
+                break
+        except (requests.exceptions.RequestException,ValueError):
             pass
 
-    print("ORS is up")
+        if time.time() - start >= max_wait:
+            raise TimeoutError(f"ORS was not ready after {max_wait} seconds")
+        sleep(backoff)
+        backoff = min(2*backoff,max_backoff)
+
+    time_to_ready = time.time() - start
+    print(f"ORS is up - ready after {time_to_ready:.1f} s")
+    return time_to_ready
+
+def warm_up_ORS(client,destination=(8.711128, 45.62712),path='data/mxp/transit_stops.csv'):
+    '''
+    Fires a batch of representative MXP routes so that the JVM and the graph caches of ORS
+    are primed before the first simulated time-window.
+
+    Args:
+        client (openrouteservice.client) : The loaded local instance of the ORS router
+        destination (tuple) : Coordinates of MXP in the (long,lat) format
+        path (str) : CSV file with the transit points that feed MXP
+
+    Returns:
+        warm_up (float) : Time (seconds) spent in the warm-up queries
+    '''
+    start = time.time()
+    stops = pd.read_csv(path)
+    origins = list(zip(stops['stop_lon'],stops['stop_lat']))
+
+    # Both plain and geojson requests are used during the simulation
+    for origin in origins:
+        try:
+            client.directions((origin,destination),radiuses=250)
+            client.directions((destination,origin),radiuses=250)
+            client.directions([origin,destination],format_out='geojson',profile='driving-car',
+                              instructions=True,attributes=['avgspeed'])
+        except Exception:
+            continue
+
+    warm_up = time.time() - start
+    print(f"ORS warm-up with {3*len(origins)} routes finished in {warm_up:.1f} s")
+    return warm_up
+
+def get_first_mile_hash(origins,transit_nodes,profile='driving-car'):
+    '''
+    Content hash of the inputs of the first mile matrix, stored in its first line to detect stale files.
+
+    Args:
+        origins (dict) : Representative (long,lat) point per origin region
+        transit_nodes (dict) : Transit points towards MXP as loaded in the model
+        profile (str) : ORS profile of the requests
+
+    Returns:
+        hash (str) : Hexadecimal sha256 digest
+    '''
+    digest = hashlib.sha256(profile.encode())
+    for nil,(lon,lat) in origins.items():
+        digest.update(f"{nil}:{float(lon)!r},{float(lat)!r};".encode())
+    for name,node in transit_nodes.items():
+        lon,lat = node['lonlat']
+        digest.update(f"{name}:{float(lon)!r},{float(lat)!r};".encode())
+    return digest.hexdigest()
+
+def get_first_mile_matrix(client,polygons,varese_pop,transit_nodes,path='data/milano/first_mile_matrix.csv'):
+    '''
+    Loads the car travel times from every origin region to the transit points towards MXP.
+    If the file does not exist, or the origin regions or the transit points (names and positions) changed since it was stored,
+    the matrix is requested once from ORS and stored.
+
+    Args:
+        client (openrouteservice.client) : The loaded local instance of the ORS router
+        polygons (GeoJSON) : Set of polygons describing the spatial characteristics of the NILS
+        varese_pop (pd.DataFrame) : Population data of the Varese regions (with lat,lon columns)
+        transit_nodes (dict) : Transit points towards MXP as loaded in the model
+        path (str) : CSV file where the matrix is stored
+
+    Returns:
+        first_mile (pd.DataFrame) : Travel times (minutes) indexed by the NIL of the origin, one column per transit point
+    '''
+    # One representative point per origin region
+    origins = {}
+    for _,r in polygons.iterrows():
+        point = r['geometry'].representative_point()
+        origins[int(r['ID_NIL'])] = (point.x,point.y)
+    for _,r in varese_pop.iterrows():
+        origins[int(r['NIL'])] = (r['lon'],r['lat'])
+
+    key = get_first_mile_hash(origins,transit_nodes)
+    if os.path.exists(path):
+        with open(path) as f:
+            stored = f.readline().strip()
+        if stored == f"# {key}":
+            return pd.read_csv(path,index_col=0,skiprows=1)
+
+    locations = list(origins.values()) + [transit_nodes[x]['lonlat'] for x in transit_nodes.keys()]
+    matrix = client.distance_matrix(locations=locations,profile='driving-car',metrics=['duration'],
+                                    sources=list(range(len(origins))),
+                                    destinations=list(range(len(origins),len(locations))))
+
+    # Unroutable pairs are returned as None
+    durations = np.array(matrix['durations'],dtype=float)/60
+    first_mile = pd.DataFrame(durations,index=list(origins.keys()),columns=list(transit_nodes.keys()))
+    first_mile.index.name = 'NIL'
+    with open(path,'w',newline='') as f:
+        f.write(f"# {key}\n")
+        first_mile.to_csv(f)
+    print("Stored first mile matrix")
+    return first_mile
 
 def close_ORS():
     '''
@@ -406,10 +527,13 @@ def insert_disruption_road(client,road_name,perc = 1,slow_down = False,slow_perc
         client (openrouteservice.client) : The loaded local instance of the ORS router
         road_name (str) : Examined road name as listed in the CSV on the data/disruptions/roads.csv file
         perc (float) : Percentage of the road that is affected
+        slow_down (bool) : Flag for a slow down of the traffic; the road is closed otherwise
+        slow_perc (float) : Travel time multiplier on the affected part of the road
 
     Returns:
         polygon_avoid : List of coordinates forming a polygon in the long,lat format
         polygon_plot : List of coordinates forming a polygon in the lat,long format
+        factor (float) : Travel time multiplier on the affected part of the road (np.inf for a closure)
     '''
 
     if os.path.exists(f"data/disruptions/{road_name}.geojson"):
@@ -450,12 +574,88 @@ def insert_disruption_road(client,road_name,perc = 1,slow_down = False,slow_perc
         print('# Geodesic area: {:.3f} m^2'.format(area))
         
         if slow_down == False:
-            return polygon_avoid,polygon_plot,{}
+            return polygon_avoid,polygon_plot,np.inf
         else:
-            edge_speed_keys = [x['name'] for x in speed]
-            edge_speed_values = [slow_perc*perc*x['duration']+(1-perc)*x['duration'] for x in speed]
-            edge_speed = {index: element for index, element in zip(edge_speed_keys,edge_speed_values)}
-            return polygon_avoid,polygon_plot,edge_speed    
+            return polygon_avoid,polygon_plot,slow_perc
+
+class RoadSpeedProfile:
+    '''
+    Time-dependent speed layer of the road network. Every disrupted road section is an edge of the layer with a
+    minute-indexed travel time multiplier; overlapping disruptions on the same section multiply their effect.
+    '''
+
+    def __init__(self,horizon=1441):
+        '''
+        Initialize an empty speed layer (no disruptions).
+
+        :param horizon: Number of minutes covered by the layer.
+        '''
+        self.horizon = horizon
+        self.disruptions = []
+        self.multipliers = np.ones((0,horizon))
+
+    def add_disruption(self,name,polygon_avoid,start,end,factor):
+        '''
+        Adds a disrupted road section to the layer.
+
+        :param name: Name of the disruption (e.g. road name as listed in data/disruptions/roads.csv).
+        :param polygon_avoid: List of coordinates forming the polygon of the section in the long,lat format.
+        :param start: Start of the disruption (minutes from midnight).
+        :param end: End of the disruption (minutes from midnight).
+        :param factor: Travel time multiplier on the section (np.inf for a closure).
+        '''
+        row = np.ones((1,self.horizon))
+        row[0,start:end] = factor
+        self.multipliers = np.vstack([self.multipliers,row])
+        self.disruptions.append({'name':name,'polygon':Polygon(polygon_avoid),'coordinates':polygon_avoid})
+
+    def at(self,minute):
+        '''
+        Returns the state of the layer at a specific minute or [] if no disruption is active.
+
+        :param minute: Examined minute (minutes from midnight).
+        '''
+        minute = min(minute,self.horizon-1)
+        active = np.flatnonzero(self.multipliers[:,minute] != 1)
+        if len(active) == 0:
+            return []
+
+        closed = [self.disruptions[x]['coordinates'] for x in active if np.isinf(self.multipliers[x,minute])]
+        avoid_polygon = None
+        if closed != []:
+            avoid_polygon = {"coordinates": [[x] for x in closed],"type": "MultiPolygon"}
+        return {'profile':self,'minute':minute,'names':[self.disruptions[x]['name'] for x in active],
+                'avoid_polygon':avoid_polygon}
+
+    def apply(self,route,minute):
+        '''
+        Corrects the step durations and the summary of a route (geojson format) in place for the examined minute.
+
+        :param route: A feature of an openrouteservice request in the geojson format.
+        :param minute: Examined minute (minutes from midnight).
+
+        :return: The corrected duration of the route in seconds.
+        '''
+        minute = min(minute,self.horizon-1)
+        coords = np.asarray(route['geometry']['coordinates'])[:,0:2]
+
+        # Multiplier per vertex of the route
+        factor = np.ones(coords.shape[0])
+        for row,disruption in enumerate(self.disruptions):
+            if self.multipliers[row,minute] != 1:
+                inside = contains_xy(disruption['polygon'],coords[:,0],coords[:,1])
+                factor[inside] *= self.multipliers[row,minute]
+
+        # Average multiplier over the vertices of each step
+        cum_factor = np.concatenate([[0],np.cumsum(factor)])
+        duration = 0
+        for segment in route['properties']['segments']:
+            for step in segment['steps']:
+                i,j = step['way_points']
+                step['duration'] = step['duration']*(cum_factor[j+1]-cum_factor[i])/(j+1-i)
+                duration += step['duration']
+        route['properties']['summary']['duration'] = duration
+        return duration
 
 def plot_map(heroya_point,disruption,lines=[]):
 
@@ -38,12 +38,13 @@ def break_train(pass_shuffle, model,station,flow_update):
             proc_time = 1
             
             if agent.bags == 1:
+                gate = model.gate_index[agent.gate]
                 if agent.MODE == "CAR" or agent.MODE == "TAXI" or agent.MODE == None:
-                    proc_time += model.arr_to_check.loc[agent.gate,"Time Car (min)"]
+                    proc_time += gate.time_car
                 else:
-                    proc_time += model.arr_to_check.loc[agent.gate,"Time Train (min)"]
-                proc_time + model.waiting_time[f"C{model.arr_to_check.loc[agent.gate,'Check-in']}"]+2
-                proc_time += model.queue_chars[f"C{model.arr_to_check.loc[agent.gate,'Check-in']}"]['walk']
+                    proc_time += gate.time_train
+                proc_time + model.waiting_time[gate.check_in]+2
+                proc_time += model.queue_chars[gate.check_in]['walk']
             else:
                 if agent.MODE == "CAR" or agent.MODE == "TAXI" or agent.MODE == None:
                     proc_time += model.queue_chars["CAR"]['walk']
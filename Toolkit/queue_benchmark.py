@@ -0,0 +1,282 @@
+##################################################################### Queue Engine Benchmark ##################################################################
+
+import os
+import sys
+import json
+import time
+import argparse
+from types import SimpleNamespace
+import numpy as np
+import pandas as pd
+from Toolkit.queue_decision_support import get_queues,get_queue_chars,update_flows,FlowMatrix,QueueEngine
+from Toolkit.terminal_simulation import TerminalSimulator
+from Toolkit.demand_pregeneration import load_demand_inputs,generate_day_demand
+from Toolkit.demand_scaler import scale_flight_schedule
+from Toolkit.flight_index import build_flight_index,build_gate_index
+from Toolkit.data_bundle import load_data_bundle
+
+# Default staffing and processing rates of config.py
+DEFAULT_ARGS = {'min_open' : 5,'trigger' : 7,'increase' : 3,'step_x' : 30,'check_in_proc' : 60,'x_ray_proc' : 200}
+
+# Allowed disagreement with get_queues per engine; engines without an entry (e.g. the stochastic TerminalSimulator) are only reported
+TOLERANCES = {'queue_engine' : {'waiting_time' : 0,'queue_people' : 0,'servers' : 0,'min speedup' : 10}}
+
+# Modal split of run_model per time band: night (before 7:00 and after 20:00), midday (9:00-15:00) and the rest of the day
+MODES = ['CAR','TRAIN','COACH','TAXI']
+MODAL_SPLIT = {'night' : [0.64,0.08,0.13,0.15],'midday' : [0.63,0.17,0.13,0.07],'peak' : [0.53,0.3,0.13,0.04]}
+
+def get_fixture_path(date,factor,seed,folder='data/benchmarks'):
+
+    '''
+    Args:
+        date (str) : date in the (%YYYY-%m-%d) format, as given in the configuration
+        factor (float) : Expected amount of flights per original flight
+        seed (int) : Seed that the fixture was recorded with
+        folder (str) : Folder of the fixtures
+
+    Returns:
+        path (str): File of the recorded flows.
+    '''
+    return f"{folder}/flows_{pd.Timestamp(date).date()}_x{factor:g}_seed_{seed}.npz"
+
+def sample_modes(minutes,rng):
+
+    '''
+    Samples the mode of every trip with the modal split of run_model at its activation minute:
+
+    Args:
+        minutes (np.array) : Activation minute per trip
+        rng (np.random.Generator) : Random generator
+
+    Returns:
+        modes (np.array): Mode per trip.
+    '''
+    band = np.select([(minutes < 7*60) | (minutes >= 20*60),(minutes >= 9*60) & (minutes < 15*60)],[0,1],2)
+    cumulative = np.cumsum(list(MODAL_SPLIT.values()),axis=1)[band]
+    choice = (rng.random(len(minutes))[:,None] >= cumulative).sum(axis=1)
+    return np.array(MODES)[np.minimum(choice,len(MODES)-1)]
+
+def record_flow_fixture(date='2023-6-1',factor=1,seed=0,folder='data/benchmarks',workers=1):
+
+    '''
+    Records the arrivals at the queues (flow_update) of a full day of departures, optionally on a scaled flight schedule.
+    Trips reach the terminal 30-90 minutes after they start with the modal split of run_model, as in initial_state,
+    so that fixtures are recorded without the routing services. The fixtures in data/benchmarks are committed, so record them
+    again only on purpose (--record), e.g. when the layout of the queues changes.
+
+    Args:
+        date (str) : date in the (%YYYY-%m-%d) format, as given in the configuration
+        factor (float) : Expected amount of flights per original flight (1 for the baseline)
+        seed (int) : Seed of the demand and of the scaled schedule
+        folder (str) : Folder that the fixture is written to
+        workers (int) : Amount of processes generating clusters in parallel
+
+    Returns:
+        flows (FlowMatrix): Arrivals at the queues per minute and point of the whole day.
+    '''
+    rng = np.random.default_rng(seed)
+    inputs = load_demand_inputs(date)
+    if factor != 1:
+        passenger_data,flight_data = scale_flight_schedule(inputs['passenger_data'],inputs['flight_data'],factor,rng=rng)
+        inputs.update({'passenger_data' : passenger_data,'flight_data' : flight_data,'flight_index' : build_flight_index(flight_data)})
+    demand = generate_day_demand(inputs,seed,workers=workers)
+
+    bundle = load_data_bundle()
+    queue_chars = get_queue_chars(bundle['arr_to_xray'])
+    model = SimpleNamespace(gate_index=build_gate_index(bundle['arr_to_check']),queue_chars=queue_chars)
+
+    minutes = demand['activation_time'].to_numpy(dtype=int)
+    arr_time = minutes + rng.integers(30,91,len(demand))
+    modes = sample_modes(minutes,rng)
+
+    flows = FlowMatrix([x for x in queue_chars.keys() if 'mean_service_time' in queue_chars[x]])
+    for mode,bags,gate,persons,arrival in zip(modes.tolist(),demand['Bags'].tolist(),demand['Gate'].tolist(),
+                                              demand['no_persons'].tolist(),arr_time.tolist()):
+        update_flows(model,mode,bags,gate,persons,arrival,flows)
+
+    os.makedirs(folder,exist_ok=True)
+    np.savez_compressed(get_fixture_path(date,factor,seed,folder),matrix=flows.matrix,points=np.array(flows.points))
+    return flows
+
+def load_flow_fixture(date='2023-6-1',factor=1,seed=0,folder='data/benchmarks'):
+
+    '''
+    Loads a recorded fixture; fixtures are never recorded implicitly, so that changes in demand generation do not move the reference
+
+    Returns:
+        flows (FlowMatrix): Arrivals at the queues per minute and point of the whole day.
+    '''
+    path = get_fixture_path(date,factor,seed,folder)
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"{path} is missing; record it with python -m Toolkit.queue_benchmark --record")
+    stored = np.load(path)
+    flows = FlowMatrix(stored['points'].tolist(),horizon=stored['matrix'].shape[0])
+    flows.matrix[:] = stored['matrix']
+    return flows
+
+def get_reference_frame(flows,st):
+
+    '''
+    Rebuilds the input of get_queues from the arrivals up to the examined minute, as run_model did before the queue engines
+
+    Returns:
+        f_df (pd.DataFrame): People per minute (index) and point (columns); missing entries are 1e-16.
+    '''
+    minutes,points = np.nonzero(flows.matrix[:st+1])
+    if len(minutes) == 0:
+        return None
+    names = np.array(flows.points)[points]
+    dataset = pd.Series(flows.matrix[minutes,points],index=pd.MultiIndex.from_arrays([minutes,names]))
+    return dataset.unstack().fillna(1e-16)
+
+def _at(values,st):
+    return {x : round(y[st]) if type(y) != int else 0 for x,y in values.items()}
+
+def benchmark_fixture(flows,queue_chars,args,engines,step=10,reference=True):
+
+    '''
+    Replays a fixture with the update frequency of run_model and times get_queues and every engine,
+    comparing the values that run_model reads (rounded waiting time and queue at the examined minute, servers).
+    Points that an engine reports transfers past the horizon for (QueueEngine.dropped) are left out of the comparison from that update on,
+    since get_queues moves those people to an earlier minute instead; they are counted under excluded.
+
+    Args:
+        flows (FlowMatrix) : Arrivals at the queues per minute and point of the whole day
+        queue_chars (dict) : Queue characteristics for specific points in the airport
+        args (argparse.Namespace) : Configuration holding min_open, trigger, increase and step_x
+        engines (dict) : Name : constructor taking (queue_chars, args), e.g. {'sbc' : QueueEngine}
+        step (int) : Minutes between updates
+        reference (bool) : Whether get_queues is run; without it engines are only timed
+
+    Returns:
+        report (dict): Runtime and updates of get_queues, and runtime and disagreements of every engine.
+    '''
+    model = SimpleNamespace(args=args)
+    updates = [st for st in range(0,flows.matrix.shape[0],step) if flows.any(st)]
+    report = {'persons' : float(flows.matrix.sum()),'updates' : len(updates),'engines' : {}}
+
+    expected = []
+    if reference:
+        runtime = 0
+        for st in updates:
+            start = time.perf_counter()
+            with np.errstate(all='ignore'):
+                waiting_time,servers,queue_people = get_queues(get_reference_frame(flows,st),queue_chars,model)
+            runtime += time.perf_counter()-start
+            expected.append((_at(waiting_time,st),servers[st] if len(servers) > st else int(args.min_open),_at(queue_people,st)))
+        report['get_queues'] = {'runtime (s)' : runtime,'per update (ms)' : 1000*runtime/max(len(updates),1)}
+
+    for name,engine in engines.items():
+        instance = engine(queue_chars,args)
+        runtime = 0
+        results,excluded = [],[]
+        for st in updates:
+            start = time.perf_counter()
+            waiting_time,servers,queue_people = instance.advance(flows,st)
+            runtime += time.perf_counter()-start
+            results.append((_at(waiting_time,st),int(servers[st]),_at(queue_people,st)))
+            dropped = instance.dropped() if hasattr(instance,'dropped') else {}
+            excluded.append([dropped.get(x,0) > 0 for x in queue_chars.keys()])
+        excluded = np.array(excluded,dtype=bool).reshape(-1,len(queue_chars))
+
+        report['engines'][name] = {'runtime (s)' : runtime,'per update (ms)' : 1000*runtime/max(len(updates),1)}
+        if reference:
+            if runtime > 0:
+                report['engines'][name]['speedup'] = report['get_queues']['runtime (s)']/runtime
+            agreement = {}
+            for idx,key in [(0,'waiting_time'),(2,'queue_people')]:
+                diffs = np.array([[abs(y[idx][x]-z[idx][x]) for x in queue_chars.keys()] for y,z in zip(results,expected)]).reshape(-1,len(queue_chars))
+                diffs = np.where(excluded,0,diffs)
+                agreement[key] = {'max abs diff' : float(diffs.max(initial=0)),'mismatches' : int((diffs > 0).sum()),
+                                  'worst point' : list(queue_chars.keys())[int(diffs.max(axis=0,initial=0).argmax())] if diffs.any() else None}
+            agreement['servers'] = {'max abs diff' : int(max([abs(y[1]-z[1]) for y,z in zip(results,expected)],default=0)),
+                                    'mismatches' : int(sum([y[1] != z[1] for y,z in zip(results,expected)]))}
+            agreement['excluded'] = {'comparisons' : int(excluded.sum()),'points' : [x for x,y in zip(queue_chars.keys(),excluded.any(axis=0)) if y],
+                                     'dropped people' : float(sum(instance.dropped().values())) if hasattr(instance,'dropped') else 0.0}
+            report['engines'][name]['agreement'] = agreement
+    return report
+
+def check_report(report,tolerances=TOLERANCES):
+
+    '''
+    Compares a report of run_benchmark against the tolerances of the engines:
+
+    Args:
+        report (dict) : Output of run_benchmark
+        tolerances (dict) : Engine : maximum abs diff of waiting_time, queue_people and servers, and minimum speedup, see TOLERANCES
+
+    Returns:
+        failures (list): Description of every value outside its tolerance; empty if the report passes.
+    '''
+    failures = []
+    for fixture,results in report['fixtures'].items():
+        for name,limits in tolerances.items():
+            if name not in results['engines'] or 'agreement' not in results['engines'][name]:
+                continue
+            engine = results['engines'][name]
+            for key in ['waiting_time','queue_people','servers']:
+                if engine['agreement'][key]['max abs diff'] > limits[key]:
+                    failures.append(f"{fixture} {name}: {key} differs by {engine['agreement'][key]['max abs diff']} (tolerance {limits[key]})")
+            if engine.get('speedup',np.inf) < limits['min speedup']:
+                failures.append(f"{fixture} {name}: speedup {engine['speedup']:.1f} below {limits['min speedup']}")
+    return failures
+
+def run_benchmark(date='2023-6-1',factors=(1,2,5),seed=0,step=10,output='data/benchmarks/report.json',folder='data/benchmarks',
+                  workers=1,engines=None,reference=True,record=False):
+
+    '''
+    Benchmarks get_queues and the queue engines on recorded fixtures and writes a JSON report:
+
+    Args:
+        date (str) : date in the (%YYYY-%m-%d) format, as given in the configuration
+        factors (iterable) : Load factors of the flight schedule, one fixture each
+        seed (int) : Seed of the fixtures and of the stochastic engines
+        step (int) : Minutes between updates
+        output (str) : JSON file of the report
+        folder (str) : Folder of the fixtures
+        workers (int) : Amount of processes recording fixtures in parallel
+        engines (dict) : Name : constructor taking (queue_chars, args); QueueEngine and TerminalSimulator if not given
+        reference (bool) : Whether get_queues is run and compared against
+        record (bool) : Whether the fixtures are recorded again before the benchmark
+
+    Returns:
+        report (dict): Configuration and results per fixture, as written to output.
+    '''
+    args = SimpleNamespace(**DEFAULT_ARGS)
+    queue_chars = get_queue_chars(load_data_bundle()['arr_to_xray'],args.check_in_proc,args.x_ray_proc)
+    if engines == None:
+        engines = {'queue_engine' : QueueEngine,'terminal_simulation' : lambda q,a: TerminalSimulator(q,a,rng=seed)}
+
+    report = {'date' : str(pd.Timestamp(date).date()),'seed' : seed,'step' : step,'args' : DEFAULT_ARGS,'fixtures' : {}}
+    for factor in factors:
+        flows = record_flow_fixture(date,factor,seed,folder,workers) if record else load_flow_fixture(date,factor,seed,folder)
+        report['fixtures'][f"x{factor:g}"] = benchmark_fixture(flows,queue_chars,args,engines,step,reference)
+        print(f"x{factor:g} : " + ", ".join([f"{x} {y['per update (ms)']:.1f} ms" for x,y in report['fixtures'][f"x{factor:g}"]['engines'].items()]))
+
+    os.makedirs(os.path.dirname(output) or '.',exist_ok=True)
+    with open(output,'w') as f:
+        json.dump(report,f,indent=2)
+    return report
+
+if __name__ == "__main__":
+
+    # Run from the repository root, e.g. python -m Toolkit.queue_benchmark --date 2023-6-1 --factors 1 2 5
+    parser = argparse.ArgumentParser(description="Benchmark get_queues and the queue engines on recorded flow fixtures")
+    parser.add_argument("--date", default="2023-6-1", help="Examined date in the YYYY-M-D format")
+    parser.add_argument("--factors", type=float, nargs="+", default=[1,2,5], help="Load factors of the flight schedule")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the fixtures and of the stochastic engines")
+    parser.add_argument("--step", type=int, default=10, help="Minutes between updates")
+    parser.add_argument("--output", default="data/benchmarks/report.json", help="JSON file of the report")
+    parser.add_argument("--workers", type=int, default=1, help="Processes recording fixtures in parallel")
+    parser.add_argument("--no_reference", action="store_true", help="Only time the engines, without get_queues")
+    parser.add_argument("--record", action="store_true", help="Record the fixtures again before the benchmark")
+    args = parser.parse_args()
+
+    report = run_benchmark(args.date,args.factors,args.seed,args.step,args.output,workers=args.workers,
+                           reference=not args.no_reference,record=args.record)
+
+    # A non-zero exit status marks a regression of the terminal model
+    failures = check_report(report)
+    for failure in failures:
+        print(f"FAILED {failure}")
+    sys.exit(1 if failures else 0)
@@ -1,5 +1,4 @@
 ##################################################################### Network Representations for Use-Cases ##################################################################
-import math
 import numpy as np
 import matplotlib.pyplot as plt
 import pandas as pd
@@ -9,6 +8,60 @@ plt.style.use(['science',"no-latex"])
 plt.rc('font',**{'family':'sans-serif','sans-serif':['Century Gothic']})
 plt.rcParams['figure.figsize'] = [16, 8]
 
+def get_erlang_b(a,c):
+
+    '''
+    Erlang-B blocking probability from the recursion B(k) = a*B(k-1)/(k + a*B(k-1)), B(0) = 1, which stays finite for any amount of servers:
+
+    Args:
+        a (np.array) : offered load (arrival rate over processing rate) per unit of time.
+        c (np.array) : available servers per unit of time.
+
+    Returns:
+        B (np.array): Probability that all c servers are busy; a scalar for scalar inputs.
+    '''
+
+    # Single timestep of the SBC recursion
+    if not hasattr(a,'__len__') and not hasattr(c,'__len__'):
+        a,B = float(a),1.0
+        for k in range(1,int(c)+1):
+            B = a*B/(k+a*B)
+        return np.float64(B)
+
+    # Same amount of servers everywhere (e.g. all check-in areas at a timestep)
+    if not hasattr(c,'__len__'):
+        B = np.ones(np.shape(a))
+        for k in range(1,int(c)+1):
+            t = a*B
+            B = t/(k+t)
+        return B[()]
+
+    a = np.asarray(a,dtype=float)
+    c = np.asarray(c,dtype=int)
+    B = np.ones(np.broadcast(a,c).shape)
+    out = np.where(c == 0,B,0.0)
+    for k in range(1,int(c.max(initial=0))+1):
+        B = a*B/(k+a*B)
+        out = np.where(c == k,B,out)
+    return out[()]
+
+def get_erlang_c(a,c):
+
+    '''
+    Erlang-C probability of waiting, derived from Erlang-B as C = B/(1-rho*(1-B)):
+
+    Args:
+        a (np.array) : offered load (arrival rate over processing rate) per unit of time.
+        c (np.array) : available servers per unit of time.
+
+    Returns:
+        C (np.array): Probability that an arrival has to wait; a scalar for scalar inputs.
+    '''
+
+    B = get_erlang_b(a,c)
+    rho = a/c
+    return B/(1-rho*(1-B))
+
 def get_approx_measures(l,mu,c):
 
     '''
@@ -25,7 +78,7 @@ def get_approx_measures(l,mu,c):
         l_mar (float) : Modified arrival rate for the SBC approach
     '''
 
-    P = (l/mu)**c/(math.factorial(c)*(sum([((l/mu)**x)/(math.factorial(x)) for x in range(0,c+1)])))
+    P = get_erlang_b(l/mu,c)
     E = (l-P*l)/(c*mu)
     l_mar = c*mu*E
     return P,E,l_mar
@@ -43,15 +96,13 @@ def get_mmc_measures(l_mar,mu,c):
 
     Returns:
         L_q (float): Number of people in the queue
-        W (float): Waiting time in the queue in minutes
+        W (float): Waiting time in the queue in minutes; NaN where l_mar is 0
     '''
 
     rho = l_mar/(c*mu)
-    cons = ((c*rho)**c)/(math.factorial(c)*((1-rho)))
-    P_0 = sum([((c*rho)**x)/(math.factorial(x))  for x in range(0,c)]) + cons
-    P_0 = (P_0)**(-1)
-    Lq = (P_0 *(l_mar/mu)**c*rho)/(math.factorial(c)*((1-rho)**2))
-    W = Lq/l_mar
+    Lq = get_erlang_c(l_mar/mu,c)*rho/(1-rho)
+    with np.errstate(divide='ignore',invalid='ignore'):
+        W = Lq/l_mar
     return Lq,W
 
 def get_mdc_measures(l_mar,mu,c,W_m):
@@ -77,6 +128,84 @@ def get_mdc_measures(l_mar,mu,c,W_m):
     Lq = W*l_mar
     return Lq,W
 
+def get_queue_chars(arr_to_xray,check_in_proc=60,x_ray_proc=200,departures_plan=None,passport_proc=120,passport_desks=6,gate_proc=400,
+                    walk_airside=3,walk_gate=5,look_ahead=180,horizon=1441):
+
+    '''
+    Queue characteristics of the check-in areas (C1-C11) and the X-RAY, optionally followed by passport control and the gates:
+
+    Args:
+        arr_to_xray (xlsx file): Dataframe read from data/mxp/arr_to_xray.xlsx; walking times towards the X-RAY
+        check_in_proc (int) : Hourly users processed per server in check-in areas
+        x_ray_proc (int) : Hourly users processed per server at the X-RAY
+        departures_plan (pd.DataFrame) : Departures of the examined day (Pax, Gate, SCHENGEN, Departure Time (min)); adds PASSPORT and one point
+                                         per gate (G<gate>) routed by the share of passengers of every gate, non-Schengen ones through PASSPORT
+        passport_proc (int) : Hourly users processed per passport desk
+        passport_desks (int) : Open passport desks
+        gate_proc (int) : Hourly users processed per gate
+        walk_airside (float) : Walking time from the X-RAY to passport control or to the Schengen gates (min)
+        walk_gate (float) : Walking time from passport control to the gates (min)
+        look_ahead (int) : Minutes after leaving the X-RAY or passport control in which the flights that set the shares of the gates depart
+        horizon (int) : Amount of minutes in the day (timesteps of the queues)
+
+    Returns:
+        queue_chars (dict): Processing rate, S_SQUARED, transitions and walking time (and servers, if fixed) per point; CAR and TRAIN only hold walking times.
+                            Shares (trans) hold one value per transition, or one row per transition and a column per minute (see get_shares).
+    '''
+    queue_chars = {f'C{i}': {'mean_service_time':int(check_in_proc)/60, "S_SQUARED": (0-2) ** 2 / 12, 'trans': [1],
+                             "trans_point": ["X-RAY"],'walk' : arr_to_xray.loc[i]['Time (min)']} for i in range(1, 12)}
+    queue_chars['CAR'] = {'walk' : arr_to_xray.loc['CAR']['Time (min)']}
+    queue_chars['TRAIN'] = {'walk' : arr_to_xray.loc['TRAIN']['Time (min)']}
+    queue_chars["X-RAY"] = {'mean_service_time': int(x_ray_proc)/60, "S_SQUARED": (1 - 4) ** 2 / 12, 'trans': [],
+                            "trans_point": []}
+    if departures_plan is None:
+        return queue_chars
+
+    # Passengers per gate and departure minute, split by the need of passport control (outside the Schengen area, as in demand generation)
+    passport = ~departures_plan['SCHENGEN'].astype(bool) if 'SCHENGEN' in departures_plan.columns else departures_plan['Passport'].astype(bool)
+    plan = departures_plan[departures_plan['Pax'] > 0]
+    gate_ids = np.unique(plan['Gate'].astype(int))
+    gates = [f"G{x}" for x in gate_ids]
+    pax = np.zeros((2,len(gate_ids),horizon))
+    minutes = np.clip(plan['Departure Time (min)'].to_numpy(dtype=float),0,horizon-1).astype(int)
+    np.add.at(pax,(passport.loc[plan.index].to_numpy(dtype=int),np.searchsorted(gate_ids,plan['Gate'].astype(int)),minutes),plan['Pax'].to_numpy(dtype=float))
+
+    # Passengers leaving a point at a minute board the flights departing within the look-ahead window; the whole day is used where none do
+    cumulative = np.concatenate([np.zeros((2,len(gate_ids),1)),pax.cumsum(axis=2)],axis=2)
+    start = np.arange(horizon)
+    window = cumulative[:,:,np.minimum(start+look_ahead,horizon)] - cumulative[:,:,start]
+    window = np.where(window.sum(axis=(0,1)) > 0,window,pax.sum(axis=2)[:,:,None])
+    total,non_schengen = window.sum(axis=(0,1)),window[1].sum(axis=0)
+
+    queue_chars["X-RAY"].update({'trans' : np.vstack([non_schengen/total,window[0]/total]),'trans_point' : ["PASSPORT"] + gates,'walk' : walk_airside})
+    queue_chars["PASSPORT"] = {'mean_service_time': int(passport_proc)/60, "S_SQUARED": (1 - 3) ** 2 / 12,'servers' : int(passport_desks),
+                               'trans' : [],'trans_point' : [],'walk' : walk_gate}
+    if pax[1].sum() > 0:
+        # Minutes without non-Schengen departures in the window follow the non-Schengen passengers of the whole day
+        window = np.where(non_schengen > 0,window[1],pax[1].sum(axis=1)[:,None])
+        queue_chars["PASSPORT"].update({'trans' : window/window.sum(axis=0),'trans_point' : gates})
+    for gate in gates:
+        queue_chars[gate] = {'mean_service_time': int(gate_proc)/60, "S_SQUARED": (0 - 1) ** 2 / 12,'servers' : 1,'trans' : [],'trans_point' : []}
+    return queue_chars
+
+def get_shares(trans,minutes):
+
+    '''
+    Shares of the transitions of a point (trans) at the examined minutes:
+
+    Args:
+        trans (list or np.array) : One share per transition, or one row per transition and a column per minute of the day
+        minutes (np.array) : Examined minutes
+
+    Returns:
+        shares (np.array): Share per transition (rows) and examined minute (columns).
+    '''
+    trans = np.asarray(trans,dtype=float)
+    minutes = np.asarray(minutes,dtype=int)
+    if trans.ndim == 2:
+        return trans[:,np.minimum(minutes,trans.shape[1]-1)]
+    return np.repeat(trans[:,None],len(minutes),axis=1)
+
 def get_arrival_rates(df,queue_chars,point):
 
     '''
@@ -154,9 +283,7 @@ def plot_queue_stats(t,E,Lq,Wq,point):
     plt.show()
 
 def get_queues(df,queue_chars,model):
-    next_point = {"C1":{},"C2":{},"C3":{},"C4":{},"C5":{},
-                  "C6":{},"C7":{},"C8":{},"C9":{},"C10":{},"C11":{},
-                  "X-RAY":{}}
+    next_point = {x : {} for x in queue_chars.keys()}
     waiting_time = {}
     queue_people = {}
     enter = False
@@ -203,165 +330,365 @@ def get_queues(df,queue_chars,model):
         l_t[0] = l[0]
         P[0],E[0],l_mar[0]= get_approx_measures(l_t[0],mu[0],c)
 
-        # Store M/m/c measures
-        Lq_M,Wq_M = [],[]
-
-        # Store M/d/c measures
-        Wq_D,Lq_D = [],[]
-
         # Store M/g/c (Final) measures
-        Lq,Wq,Ex_q = [],[],[]
+        Lq,Wq = [],[]
+
+        if point != "X-RAY":
 
-        for idx in range(l.shape[0]):
-            if idx != 0:       
+            # Servers of check-in areas are fixed, so only the backlog recursion is sequential
+            for idx in range(1,l.shape[0]):
                 l_t[idx] = l[idx] + P[idx-1]*l_t[idx-1] # Modify l tilde
                 P[idx],E[idx],l_mar[idx]= get_approx_measures(l_t[idx],mu[idx],c)
 
-            # Store M/M/C
-            Lq_m,Wq_m = get_mmc_measures(l_mar[idx],mu[idx],c)
-            Lq_M.append(Lq_m)
-            Wq_M.append(Wq_m)
-
-            # Store M/D/c
-            Lq_d,Wq_d = get_mdc_measures(l_mar[idx],mu[idx],c,Wq_m) 
-            Wq_D.append(Wq_d)
-            Lq_D.append(Lq_d)
+            Lq_m,Wq_m = get_mmc_measures(l_mar,mu,c)
+            Lq_d,Wq_d = get_mdc_measures(l_mar,mu,c,Wq_m)
 
             # Cosmetatos Approximation p.231 (6.81)
-            W = (s2*Wq_m + (1-s2)*Wq_d)
+            with np.errstate(invalid='ignore'):
+                W = s2*Wq_m + (1-s2)*Wq_d
+            W = np.where(np.isnan(W),0,W)
+            Wq = W.tolist()
+            Lq = (W*l_mar).tolist()
+            walk = queue_chars[point]['walk']
+        else:
+            for idx in range(l.shape[0]):
+                if idx != 0:
+                    l_t[idx] = l[idx] + P[idx-1]*l_t[idx-1] # Modify l tilde
+                    P[idx],E[idx],l_mar[idx]= get_approx_measures(l_t[idx],mu[idx],c)
 
-            if np.isnan(W):
-                W = 0
-            L = (W)*l_mar[idx]
+                # M/M/C and M/D/C measures
+                Lq_m,Wq_m = get_mmc_measures(l_mar[idx],mu[idx],c)
+                Lq_d,Wq_d = get_mdc_measures(l_mar[idx],mu[idx],c,Wq_m)
 
-            Wq.append(W)
-            Lq.append(L)
+                # Cosmetatos Approximation p.231 (6.81)
+                W = (s2*Wq_m + (1-s2)*Wq_d)
 
-            if (W >=int(model.args.trigger) or L >=200) and (point == "X-RAY") and (idx % 30 == 0):
-                c = min(19,c+int(model.args.increase)+2)
-            elif W <=2 and point == "X-RAY" and (idx % 30 == 0) :
-                c = max(int(model.args.min_open),c-int(model.args.increase))
+                if np.isnan(W):
+                    W = 0
+                L = (W)*l_mar[idx]
 
-            if point != "X-RAY":
-                walk = queue_chars[point]['walk']
-            else:
-                walk = 0
+                Wq.append(W)
+                Lq.append(L)
+
+                if (W >=int(model.args.trigger) or L >=200) and (idx % 30 == 0):
+                    c = min(19,c+int(model.args.increase)+2)
+                elif W <=2 and (idx % 30 == 0) :
+                    c = max(int(model.args.min_open),c-int(model.args.increase))
                 servers.append(c)
-                
-            for idx2,x in enumerate(queue_chars[point]['trans_point']):
-                if round(t[idx]+mean_service+W+walk) not in next_point[x].keys():
-                    next_point[x][round(t[idx]+mean_service+W+walk)] = round(queue_chars[point]['trans'][idx2]*l[idx])
-                else:
-                    next_point[x][round(t[idx]+mean_service+W+walk)] += round(queue_chars[point]['trans'][idx2]*l[idx])
+            walk = 0
+
+        shares = get_shares(queue_chars[point]['trans'],t)
+        for idx2,x in enumerate(queue_chars[point]['trans_point']):
+            moved = np.round(shares[idx2]*l).astype(int).tolist()
+            for idx in range(l.shape[0]):
+                step = round(t[idx]+mean_service+Wq[idx]+walk)
+                next_point[x][step] = next_point[x].get(step,0) + moved[idx]
         
         waiting_time[point] = Wq
         queue_people[point] = Lq
 
     return waiting_time,servers,queue_people 
 
-def get_flows(agents_mod):
-    # Initialize an empty list to store duplicated rows
-    duplicated_rows = []
+class QueueEngine:
 
-    # Iterate through each row in the DataFrame
-    for index, row in agents_mod.iterrows():
-        # Get the value from the 'n_times' column
-        n = int(row['NO_PERSONS'])
+    '''
+    Stateful counterpart of get_queues: keeps l tilde, P, the X-RAY servers and the transfers between points of every evaluated minute,
+    so that an update only advances over the minutes since the previous one. Minutes whose arrivals changed are evaluated again.
+    Points may form any acyclic network through trans/trans_point; all points of a stage are solved in one vectorized recursion,
+    so the cost grows with the amount of stages rather than points. Points other than the X-RAY keep their servers (min_open if not given).
+    Transfers that would reach the next point at or after the last minute of the horizon are dropped (see dropped), whereas get_queues
+    adds them to the last minute it matched before them.
 
-        if n >=2:
-            # Create a copy of the row and append it to the list 'n' times
-            duplicated_rows.extend([row] * (n-1))
+    Args:
+        queue_chars (dict) : Queue characteristics for specific points in the airport, see get_queue_chars
+        args (argparse.Namespace) : Configuration holding min_open, trigger, increase and step_x for the X-RAY staffing
+        horizon (int) : Amount of minutes in the day (timesteps of the queues)
+        staffing (callable) : Optional policy (e.g. staffing_policy.plan_servers) that returns the X-RAY servers of the upcoming minutes
+                              from (l, mean_service, S_SQUARED, (l tilde, P)); re-planned every step_x minutes. The threshold rule of
+                              get_queues is used otherwise.
 
-    # Create a new DataFrame with the duplicated rows
-    duplicated_df = pd.DataFrame(duplicated_rows, columns=agents_mod.columns)
+    '''
+    def __init__(self,queue_chars,args,horizon=1441,staffing=None):
+        self.queue_chars = queue_chars
+        self.args = args
+        self.horizon = horizon
+        self.min_open = int(args.min_open)
+        self.staffing = staffing
+        self.step_x = int(getattr(args,'step_x',30))
+
+        # Only points with a processing rate are queues, the rest (CAR, TRAIN) hold walking times
+        self.points = [x for x in queue_chars.keys() if 'mean_service_time' in queue_chars[x]]
+        self.index = {x : idx for idx,x in enumerate(self.points)}
+
+        # Points are solved in stages, after every point that sends people to them (check-in areas, X-RAY, passport control, gates)
+        stage = {x : 0 for x in self.points}
+        for _ in self.points:
+            for x in self.points:
+                for y in queue_chars[x]['trans_point']:
+                    stage[y] = max(stage[y],stage[x]+1)
+        if any(stage[y] <= stage[x] for x in self.points for y in queue_chars[x]['trans_point']):
+            raise ValueError("The routing between points (trans_point) must not contain cycles")
+        self.stages = [[x for x in self.points if stage[x] == idx] for idx in range(max(stage.values(),default=-1)+1)]
+
+        shape = (len(self.points),horizon)
+        self.l = np.zeros(shape)
+        self.inflow = np.zeros(shape)
+        self.l_t,self.P = np.zeros(shape),np.zeros(shape)
+        self.W,self.L = np.zeros(shape),np.zeros(shape)
+        self.servers = np.full(horizon,self.min_open)
+
+        # Destination minute per point and minute, and people moved per transition and minute, to undo transfers of minutes evaluated again
+        self.transfers = {x : (np.zeros(horizon,dtype=int),np.zeros((len(queue_chars[x]['trans_point']),horizon)))
+                          for x in self.points if queue_chars[x]['trans_point']}
+        self.targets = {x : np.array([self.index[y] for y in queue_chars[x]['trans_point']])[:,None] for x in self.transfers.keys()}
+        self.evaluated = -1
+
+    def _to_array(self,flows):
+
+        # Arrivals of the flow matrix in the layout of the engine (point, minute)
+        l = np.zeros(self.l.shape)
+        columns = [(self.index[point],idx) for point,idx in flows.index.items() if point in self.index]
+        if columns:
+            rows,idx = zip(*columns)
+            l[list(rows),:] = flows.matrix[:self.horizon,list(idx)].T
+        return l
+
+    def _rewind(self,start):
+
+        # Remove the transfers sent from minutes that are evaluated again
+        sent = slice(start,self.evaluated+1)
+        for point,(dest,moved) in self.transfers.items():
+            valid = dest[sent] < self.horizon
+            np.subtract.at(self.inflow,(self.targets[point],dest[sent][valid][None,:]),moved[:,sent][:,valid])
+        self.evaluated = start-1
+
+    def _solve_fixed(self,points,start,end):
+
+        # Points with a fixed amount of servers are solved together, one vectorized step of the recursion per minute
+        rows = [self.index[x] for x in points]
+        mu = np.array([self.queue_chars[x]['mean_service_time'] for x in points])
+        s2 = np.array([self.queue_chars[x]['S_SQUARED'] for x in points])[:,None]
+        servers = [int(self.queue_chars[x].get('servers',self.min_open)) for x in points]
+        c_now,c = (servers[0],servers[0]) if len(set(servers)) == 1 else (np.array(servers),np.array(servers)[:,None])
+
+        # Only the evaluated minutes (and the one before them) are copied out of the state
+        lo = max(start-1,0)
+        l = self.l[rows,start:end+1] + self.inflow[rows,start:end+1]
+        l_t,P = self.l_t[rows,lo:end+1],self.P[rows,lo:end+1]
+
+        for idx in range(start-lo,end+1-lo):
+            l_t[:,idx] = l[:,idx+lo-start] + (P[:,idx-1]*l_t[:,idx-1] if idx+lo != 0 else 0) # Modify l tilde
+            P[:,idx] = get_erlang_b(l_t[:,idx]/mu,c_now)
+        self.l_t[rows,lo:end+1],self.P[rows,lo:end+1] = l_t,P
+
+        _,_,l_mar = get_approx_measures(l_t[:,start-lo:],mu[:,None],c)
+        Lq_m,Wq_m = get_mmc_measures(l_mar,mu[:,None],c)
+        Lq_d,Wq_d = get_mdc_measures(l_mar,mu[:,None],c,Wq_m)
+
+        # Cosmetatos Approximation p.231 (6.81)
+        with np.errstate(invalid='ignore'):
+            W = s2*Wq_m + (1-s2)*Wq_d
+        W = np.where(np.isnan(W),0,W)
+        self.W[rows,start:end+1] = W
+        self.L[rows,start:end+1] = W*l_mar
+
+        for idx,point in enumerate(points):
+            self._send(point,start,end,l[idx])
+
+    def _solve_staffed(self,point,start,end):
+
+        # X-RAY servers react to the waiting time, so every minute is solved on its own
+        i = self.index[point]
+        s2,mean_service = self.queue_chars[point]['S_SQUARED'],self.queue_chars[point]['mean_service_time']
+        l = self.l[i] + self.inflow[i]
+        l_t,P,W,L = self.l_t[i],self.P[i],self.W[i],self.L[i]
+        c = self.min_open if start == 0 else int(self.servers[start-1])
+
+        for idx in range(start,end+1):
+            if self.staffing != None and idx % self.step_x == 0:
+                c = int(self.staffing(l[idx:],mean_service,s2,(l_t[idx-1],P[idx-1]) if idx != 0 else (0.0,0.0))[0])
+
+            l_t[idx] = l[idx] + (P[idx-1]*l_t[idx-1] if idx != 0 else 0) # Modify l tilde
+            P[idx],_,l_mar = get_approx_measures(l_t[idx],mean_service,c)
+            Lq_m,Wq_m = get_mmc_measures(l_mar,mean_service,c)
+            Lq_d,Wq_d = get_mdc_measures(l_mar,mean_service,c,Wq_m)
 
-    # Concatenate the original DataFrame with the duplicated DataFrame
-    agents_mod = pd.concat([agents_mod, duplicated_df], ignore_index=True)
-    agents_mod = agents_mod.drop(columns=['NO_PERSONS'])
+            # Cosmetatos Approximation p.231 (6.81)
+            w = (s2*Wq_m + (1-s2)*Wq_d)
+            W[idx] = 0 if np.isnan(w) else w
+            L[idx] = W[idx]*l_mar
+
+            # Threshold rule of get_queues when there is no staffing policy
+            if self.staffing == None and idx % 30 == 0:
+                if W[idx] >=int(self.args.trigger) or L[idx] >=200:
+                    c = min(19,c+int(self.args.increase)+2)
+                elif W[idx] <=2:
+                    c = max(self.min_open,c-int(self.args.increase))
+            self.servers[idx] = c
+
+        self._send(point,start,end,l[start:end+1])
+
+    def _send(self,point,start,end,l):
+
+        # Send the processed people to the next points, all transitions at once; shares are kept fractional so that routing
+        # across many points loses no one
+        if point not in self.transfers:
+            return
+        i = self.index[point]
+        dest,moved = self.transfers[point]
+        minutes = np.arange(start,end+1)
+        mean_service = self.queue_chars[point]['mean_service_time']
+        dest[start:end+1] = np.round(minutes+mean_service+self.W[i,start:end+1]+self.queue_chars[point].get('walk',0))
+        moved[:,start:end+1] = get_shares(self.queue_chars[point]['trans'],minutes)*l
+        valid = dest[start:end+1] < self.horizon
+        np.add.at(self.inflow,(self.targets[point],dest[start:end+1][valid][None,:]),moved[:,start:end+1][:,valid])
+
+    def advance(self,flows,st):
+
+        '''
+        Evaluates the queues up to the examined minute:
+
+        Args:
+            flows (FlowMatrix) : Arrivals at the queues per minute and point
+            st (int) : Examined minute
+
+        Returns:
+            waiting_time (dict): Waiting time per point and minute
+            servers (np.array): Open X-RAY servers per minute
+            queue_people (dict): People in the queue per point and minute
+        '''
+        st = min(st,self.horizon-1)
+        l = self._to_array(flows)
+
+        # Evaluate again from the first minute whose arrivals changed
+        changed = np.nonzero((l[:,:self.evaluated+1] != self.l[:,:self.evaluated+1]).any(axis=0))[0]
+        self.l = l
+        if len(changed) > 0:
+            self._rewind(changed[0])
+
+        if st > self.evaluated:
+            for points in self.stages:
+                fixed = [x for x in points if x != "X-RAY"]
+                if fixed:
+                    self._solve_fixed(fixed,self.evaluated+1,st)
+                if "X-RAY" in points:
+                    self._solve_staffed("X-RAY",self.evaluated+1,st)
+            self.evaluated = st
+
+        waiting_time = {x : self.W[self.index[x]] if x in self.index else 0 for x in self.queue_chars.keys()}
+        queue_people = {x : self.L[self.index[x]] if x in self.index else 0 for x in self.queue_chars.keys()}
+        return waiting_time,self.servers,queue_people
+
+    def dropped(self):
+
+        '''
+        Returns:
+            dropped (dict): People per point sent from the evaluated minutes whose transfer falls after the horizon and is left out.
+        '''
+        dropped = {x : 0.0 for x in self.points}
+        for point,(dest,moved) in self.transfers.items():
+            late = dest[:self.evaluated+1] >= self.horizon
+            for row,x in enumerate(self.queue_chars[point]['trans_point']):
+                dropped[x] += float(moved[row,:self.evaluated+1][late].sum())
+        return dropped
+
+def _to_minutes(times):
+
+    # Minute of the day of datetime (or time) values; NaN where missing
+    times = pd.Series(times)
+    if pd.api.types.is_datetime64_any_dtype(times):
+        return (60*times.dt.hour + times.dt.minute).to_numpy()
+    return np.array([60*x.hour + x.minute if hasattr(x,'hour') else np.nan for x in times],dtype=float)
+
+def get_flows(agents_mod,weighted=False,rng=None):
 
-    agents_f = agents_mod.copy()
-    spawn = []
-    for idx,r in agents_mod.iterrows():
-        try:
-            agents_f.at[idx,"END_TIME"] = 60*r.E_TIME.hour +r.E_TIME.minute
-        except:
-            agents_f.at[idx,"END_TIME"] = 60*r.END_TIME.hour +r.END_TIME.minute
-        if r.MODE == "TRAIN" or r.MODE == "COACH":
-            agents_f.at[idx,"APPROACH"] = np.NaN
-            agents_f.at[idx,"DROP_OFF"] = np.NaN
-            
-            if r.MODE == "COACH":
-                spawn.append("COACH")
-            else:
-                spawn.append("TRAIN")
-            try:
-                if r.LINE_USED == "EMERGENCY COACH":
-                    spawn[-1] = "E"
-            except:
-                pass
+    '''
+    Terminal arrivals of the simulated passengers, with the point they enter the airport from (SPAWN):
 
-        else:
-            mode  = r.MODE
-            if mode == None or mode == "None":
-                mode = "CAR"
-
-            try:
-                if r.APPROACH == "SOUTH":
-                    spawn.append(f"SOUTH/{mode}")
-                else:
-                    spawn.append(f"NORTH/{mode}")
-            except:
-                if weighted_choice(50):
-                    spawn.append(f"SOUTH/{mode}")
-                else:
-                    spawn.append(f"NORTH/{mode}")
-                    
-        try:
-            b = r.STATUS
-        except:
-            agents_f.at[idx,"STATUS"] = 'NORMAL'
-            agents_f.at[idx,"ACTIVATION"] = r.ACTIVATION_TIME
+    Args:
+        agents_mod (pd.DataFrame) : Passenger groups of the run (agent results or store_generated), with NO_PERSONS per group
+        weighted (bool) : Keep one row per group with its NO_PERSONS instead of one row per person
+        rng (np.random.Generator or int) : Optional random generator (or seed) for the approach of groups without one
 
-    agents_f["SPAWN"] = spawn
-    
-    agents_f = agents_f[['FLIGHT','GATE','DEPARTURE','END_TIME','STATUS','SPAWN']]
-    agents_f = agents_f.astype(int, errors='ignore')
-    agents_f = agents_f.rename(columns={'END_TIME': 'PAX ARRIVAL'})
-    agents_f = agents_f.sort_values(by=['PAX ARRIVAL', 'DEPARTURE'])
-    return agents_f
+    Returns:
+        agents_f (pd.DataFrame): FLIGHT, GATE, DEPARTURE, PAX ARRIVAL, STATUS and SPAWN (and NO_PERSONS if weighted), sorted by arrival.
+    '''
+
+    rng = np.random.default_rng(rng)
+    columns = agents_mod.columns
+    n = len(agents_mod)
 
+    # Arrival at the airport, E_TIME is preferred over END_TIME when it is available
+    end_time = _to_minutes(agents_mod['END_TIME']) if 'END_TIME' in columns else np.full(n,np.nan)
+    if 'E_TIME' in columns:
+        end_time = np.where(agents_mod['E_TIME'].notna().to_numpy(),_to_minutes(agents_mod['E_TIME']),end_time)
+
+    # Public transport users enter from their line, the rest from the approach of their road (random if unknown)
+    mode = agents_mod['MODE'].to_numpy(dtype=object).astype(str)
+    mode[mode == "None"] = "CAR"
+    if 'APPROACH' in columns:
+        south = (agents_mod['APPROACH'] == "SOUTH").to_numpy()
+    else:
+        south = rng.random(n) < 0.5
+    spawn = np.where(south,"SOUTH/","NORTH/").astype(object) + mode
+    spawn = np.where(mode == "COACH","COACH",np.where(mode == "TRAIN","TRAIN",spawn))
+    if 'LINE_USED' in columns:
+        spawn = np.where(np.isin(mode,["TRAIN","COACH"]) & (agents_mod['LINE_USED'] == "EMERGENCY COACH").to_numpy(),"E",spawn)
+
+    agents_f = pd.DataFrame({'FLIGHT' : agents_mod['FLIGHT'].to_numpy(),'GATE' : agents_mod['GATE'].to_numpy(),
+                             'DEPARTURE' : agents_mod['DEPARTURE'].to_numpy(),'PAX ARRIVAL' : end_time,
+                             'STATUS' : agents_mod['STATUS'].to_numpy() if 'STATUS' in columns else 'NORMAL','SPAWN' : spawn})
+    if np.isfinite(end_time).all():
+        agents_f['PAX ARRIVAL'] = end_time.astype(int)
+
+    persons = agents_mod['NO_PERSONS'].to_numpy(dtype=float).astype(int)
+    if weighted:
+        agents_f['NO_PERSONS'] = persons
+    else:
+        # One row per person: the groups, followed by the extra members of every group
+        agents_f = agents_f.iloc[np.concatenate([np.arange(n),np.repeat(np.arange(n),np.maximum(persons-1,0))])].reset_index(drop=True)
+    return agents_f.sort_values(by=['PAX ARRIVAL', 'DEPARTURE'])
+
+class FlowMatrix:
+
+    '''
+    Arrivals at the queues per minute (rows) and point (columns), updated in place as passengers reach the terminal.
+
+    Args:
+        points (list) : Names of the queue points, e.g. QueueEngine.points
+        horizon (int) : Amount of minutes in the day; arrivals after it are dropped
 
-def update_flows(model,agent_mode,agent_bags,agent_gate,agent_persons,agent_ARR_TIME,flow_update = {}):
+    '''
+    def __init__(self,points,horizon=1441):
+        self.points = list(points)
+        self.index = {x : idx for idx,x in enumerate(self.points)}
+        self.matrix = np.zeros((horizon,len(self.points)))
+
+    def add(self,minute,point,persons):
+        if 0 <= minute < self.matrix.shape[0]:
+            self.matrix[minute,self.index[point]] += persons
+
+    def any(self,until):
+
+        '''
+        Whether anyone reached a queue up to (and including) the examined minute.
+        '''
+        return bool(self.matrix[:until+1].any())
+
+def update_flows(model,agent_mode,agent_bags,agent_gate,agent_persons,agent_ARR_TIME,flow_update):
     # Compute "spawning" times based on mode and profile of passengers
-    if agent_mode == "CAR" or agent_mode == "TAXI" or agent_mode == None:
-        if agent_bags == 1:
-            check_time = round(agent_ARR_TIME+model.arr_to_check.loc[agent_gate,"Time Car (min)"])
-            if (check_time, f"C{model.arr_to_check.loc[agent_gate,'Check-in']}") not in flow_update.keys(): 
-                flow_update[check_time, f"C{model.arr_to_check.loc[agent_gate,'Check-in']}"] = agent_persons
-            else:
-                flow_update[check_time, f"C{model.arr_to_check.loc[agent_gate,'Check-in']}"] += agent_persons
+    if agent_bags == 1:
+        gate = model.gate_index[agent_gate]
+        if agent_mode == "CAR" or agent_mode == "TAXI" or agent_mode == None:
+            key = (round(agent_ARR_TIME+gate.time_car), gate.check_in)
         else:
-            check_time = round(agent_ARR_TIME+model.arr_to_xray.loc['CAR',"Time (min)"])
-            if (check_time, "X-RAY") not in flow_update.keys(): 
-                flow_update[check_time, "X-RAY"] = agent_persons
-            else:
-                flow_update[check_time, "X-RAY"] += agent_persons
+            key = (round(agent_ARR_TIME+gate.time_train), gate.check_in)
     else:
-        if agent_bags == 1:
-            check_time = round(agent_ARR_TIME+model.arr_to_check.loc[agent_gate,"Time Train (min)"])
-            if (check_time, f"C{model.arr_to_check.loc[agent_gate,'Check-in']}") not in flow_update.keys(): 
-                flow_update[check_time, f"C{model.arr_to_check.loc[agent_gate,'Check-in']}"] = agent_persons
-            else:
-                flow_update[check_time, f"C{model.arr_to_check.loc[agent_gate,'Check-in']}"] += agent_persons                            
-        else:
-            check_time = round(agent_ARR_TIME+model.arr_to_xray.loc['CAR',"Time (min)"])
-            if (check_time, "X-RAY") not in flow_update.keys(): 
-                flow_update[check_time, "X-RAY"] = agent_persons
-            else:
-                flow_update[check_time, "X-RAY"] += agent_persons
+        key = (round(agent_ARR_TIME+model.queue_chars['CAR']['walk']), "X-RAY")
+    flow_update.add(key[0],key[1],agent_persons)
     return flow_update
 
-def update_safety_margins(model,agent_ARR_TIME,agent_safety,agent_bags,agent_MODE,agent_gate,st):
+def update_safety_margins(model,agent_ARR_TIME,agent_safety,agent_bags,agent_MODE,agent_gate,st,agent_passport=False):
 
     # Update Safety margins based on current conditions
     MISSED = 0
@@ -369,13 +696,18 @@ def update_safety_margins(model,agent_ARR_TIME,agent_safety,agent_bags,agent_MOD
     if agent_ARR_TIME == st:
         
         proc_time += model.waiting_time["X-RAY"]+0.5
+
+        # Passengers outside the Schengen area also queue at passport control when the airside is modelled
+        if agent_passport and model.args.airside:
+            proc_time += model.waiting_time.get("PASSPORT",0)
         if agent_bags == 1:
+            gate = model.gate_index[agent_gate]
             if agent_MODE == "CAR" or agent_MODE == "TAXI" or agent_MODE == None:
-                proc_time += model.arr_to_check.loc[agent_gate,"Time Car (min)"]
+                proc_time += gate.time_car
             else:
-                proc_time += model.arr_to_check.loc[agent_gate,"Time Train (min)"]
-            proc_time += model.waiting_time[f"C{model.arr_to_check.loc[agent_gate,'Check-in']}"]+2
-            proc_time += model.queue_chars[f"C{model.arr_to_check.loc[agent_gate,'Check-in']}"]['walk']
+                proc_time += gate.time_train
+            proc_time += model.waiting_time[gate.check_in]+2
+            proc_time += model.queue_chars[gate.check_in]['walk']
         else:
             if agent_MODE == "CAR" or agent_MODE == "TAXI" or agent_MODE == None:
                 proc_time += model.queue_chars["CAR"]['walk']
@@ -390,3 +722,50 @@ def update_safety_margins(model,agent_ARR_TIME,agent_safety,agent_bags,agent_MOD
     else:
         return 0,agent_safety,round(proc_time)
 
+
+def update_safety_margins_cohort(model,agent_ARR_TIME,agent_safety,agent_bags,agent_MODE,agent_gate,st,agent_passport=None):
+
+    '''
+    Cohort version of update_safety_margins, evaluated for whole arrays of passenger groups at once:
+
+    Args:
+        model (Milano) : Simulation model holding args, gate_index, waiting_time and queue_chars
+        agent_ARR_TIME (np.array) : Arrival minute at the airport per group
+        agent_safety (np.array) : Safety margin per group (minutes)
+        agent_bags (np.array) : Whether the group checks in bags
+        agent_MODE (np.array) : Mode of the group (CAR, TAXI or None drive to the terminal)
+        agent_gate (np.array) : Gate of the flight of the group
+        st (int or np.array) : Examined minute; only groups arriving at it are updated
+        agent_passport (np.array) : Whether the group goes through passport control (outside the Schengen area); counted with --airside
+
+    Returns:
+        MISSED (np.array): 1 for groups that are expected to miss their flight
+        agent_safety (np.array): Updated safety margins
+        proc_time (np.array): Expected minutes from arrival until the gate (rounded)
+    '''
+    arrived = np.asarray(agent_ARR_TIME) == st
+    bags = np.asarray(agent_bags).astype(bool)
+    agent_MODE = np.asarray(agent_MODE,dtype=object)
+    car = np.isin(agent_MODE,["CAR","TAXI"]) | np.equal(agent_MODE,None)
+
+    # Walking times and check-in waiting time per gate
+    gates = np.asarray(agent_gate,dtype=int)
+    size = max(model.gate_index.keys())+1
+    time_car,time_train,check_in,walk = np.zeros(size),np.zeros(size),np.zeros(size),np.zeros(size)
+    for gate in model.gate_index.values():
+        time_car[gate.gate] = gate.time_car
+        time_train[gate.gate] = gate.time_train
+        check_in[gate.gate] = model.waiting_time[gate.check_in]+2
+        walk[gate.gate] = model.queue_chars[gate.check_in]['walk']
+
+    # Same order of additions as update_safety_margins
+    x_ray = model.waiting_time["X-RAY"]+0.5
+    if agent_passport is not None and model.args.airside:
+        x_ray = x_ray + np.where(np.asarray(agent_passport).astype(bool),model.waiting_time.get("PASSPORT",0),0)
+    with_bags = x_ray + np.where(car,time_car[gates],time_train[gates]) + check_in[gates] + walk[gates]
+    without_bags = x_ray + np.where(car,model.queue_chars["CAR"]['walk'],model.queue_chars["TRAIN"]['walk'])
+    proc_time = np.where(arrived,np.where(bags,with_bags,without_bags),0)
+
+    agent_safety = np.asarray(agent_safety) - proc_time
+    MISSED = (arrived & (agent_safety <= 25)).astype(int)
+    return MISSED,agent_safety,np.round(proc_time).astype(int)
@@ -0,0 +1,75 @@
+##################################################################### X-RAY Staffing Policy ##################################################################
+
+import numpy as np
+from Toolkit.queue_decision_support import get_erlang_b,get_approx_measures,get_mmc_measures,get_mdc_measures
+
+def sbc_recursion(l,mean_service,s2,c,state=(0.0,0.0)):
+
+    '''
+    Runs the SBC recursion of a single point for several server schedules at once:
+
+    Args:
+        l (np.array) : arrival rates per unit of time.
+        mean_service (float) : processing rate of server per unit of time.
+        s2 (float) : S_SQUARED of the point, weight of the M/M/c waiting time in the Cosmetatos approximation
+        c (np.array) : available servers per schedule (rows) and unit of time (columns).
+        state (tuple) : l tilde and P of the unit of time before the first one
+
+    Returns:
+        W (np.array): Waiting time in the queue per schedule and unit of time
+        L (np.array): Number of people in the queue per schedule and unit of time
+        l_t (np.array): l tilde per schedule and unit of time
+        P (np.array): Probability of backlog per schedule and unit of time
+    '''
+    l_t,P = np.zeros(c.shape),np.zeros(c.shape)
+    prev_l,prev_P = np.full(c.shape[0],float(state[0])),np.full(c.shape[0],float(state[1]))
+    for idx in range(c.shape[1]):
+        l_t[:,idx] = l[idx] + prev_P*prev_l
+        P[:,idx] = get_erlang_b(l_t[:,idx]/mean_service,c[:,idx])
+        prev_l,prev_P = l_t[:,idx],P[:,idx]
+
+    _,_,l_mar = get_approx_measures(l_t,mean_service,c)
+    Lq_m,Wq_m = get_mmc_measures(l_mar,mean_service,c)
+    Lq_d,Wq_d = get_mdc_measures(l_mar,mean_service,c,Wq_m)
+
+    # Cosmetatos Approximation p.231 (6.81)
+    with np.errstate(invalid='ignore'):
+        W = s2*Wq_m + (1-s2)*Wq_d
+    W = np.where(np.isnan(W),0,W)
+    return W,W*l_mar,l_t,P
+
+def plan_servers(l,mean_service,s2,state=(0.0,0.0),target=7,min_open=5,max_servers=19,step=30,lookahead=60,blocks=None):
+
+    '''
+    Greedy staffing plan: every block of step minutes gets the fewest servers that keep the waiting time within target
+    over the block and the following look-ahead minutes. All server counts are evaluated in one vectorized recursion.
+
+    Args:
+        l (np.array) : arrival rates per minute, starting at the first planned minute
+        mean_service (float) : processing rate of server per minute
+        s2 (float) : S_SQUARED of the point
+        state (tuple) : l tilde and P of the minute before the first planned one
+        target (float) : Maximum waiting time in minutes
+        min_open (int) : Minimum amount of open servers
+        max_servers (int) : Maximum amount of open servers, used when the target cannot be met
+        step (int) : Minutes between staffing changes
+        lookahead (int) : Minutes after a block that its staffing should also keep within target
+        blocks (int) : Amount of blocks planned; the whole of l if not given
+
+    Returns:
+        servers (np.array): Open servers per planned minute.
+    '''
+    candidates = np.arange(min_open,max_servers+1)
+    end = len(l) if blocks == None else min(len(l),blocks*step)
+    servers = np.empty(end,dtype=int)
+    for start in range(0,end,step):
+        block = min(step,end-start)
+        window = l[start:min(len(l),start+step+lookahead)]
+        W,_,l_t,P = sbc_recursion(window,mean_service,s2,np.repeat(candidates[:,None],len(window),axis=1),state)
+
+        # Fewest servers within target, otherwise all of them
+        meets = np.nonzero((W <= target).all(axis=1))[0]
+        choice = meets[0] if len(meets) > 0 else len(candidates)-1
+        servers[start:start+block] = candidates[choice]
+        state = (l_t[choice,block-1],P[choice,block-1])
+    return servers
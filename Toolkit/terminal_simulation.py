@@ -0,0 +1,210 @@
+##################################################################### Discrete-Event Terminal Simulation ##################################################################
+
+import time
+import heapq
+from collections import deque
+import numpy as np
+import pandas as pd
+
+# Event types, departures are handled first when they coincide with an arrival
+DEPART,ARRIVE = 0,1
+
+class TerminalSimulator:
+
+    '''
+    Event-driven alternative to the SBC approximation of get_queues: every passenger is queued and served at every point of the terminal.
+    Service times follow a Gamma distribution with the processing rate (mean_service_time, people per minute per server) and the squared
+    coefficient of variation (S_SQUARED) of each point. Served passengers are routed at random through trans/trans_point, with the shares of the minute
+    they leave at. Same interface as QueueEngine.
+
+    Args:
+        queue_chars (dict) : Queue characteristics for specific points in the airport
+        args (argparse.Namespace) : Configuration holding min_open, trigger and increase for the X-RAY staffing
+        horizon (int) : Amount of minutes in the day (timesteps of the queues)
+        rng (np.random.Generator or int) : Optional random generator (or seed)
+
+    '''
+    def __init__(self,queue_chars,args,horizon=1441,rng=None):
+        self.queue_chars = queue_chars
+        self.args = args
+        self.horizon = horizon
+        self.min_open = int(args.min_open)
+        self.rng = np.random.default_rng(rng)
+
+        # Only points with a processing rate are queues, the rest (CAR, TRAIN) hold walking times
+        self.points = [x for x in queue_chars.keys() if 'mean_service_time' in queue_chars[x]]
+        self.index = {x : idx for idx,x in enumerate(self.points)}
+
+        shape = (len(self.points),horizon)
+        self.seen = np.zeros(shape)
+        self.W,self.L = np.zeros(shape),np.zeros(shape)
+        self.servers = np.full(horizon,self.min_open)
+        self.c = [int(queue_chars[x].get('servers',self.min_open)) for x in self.points]
+        self.busy = [0 for _ in self.points]
+        self.queues = [deque() for _ in self.points]
+
+        # Waits of the passengers that started their service in the examined minute
+        self.started_wait = np.zeros(len(self.points))
+        self.started = np.zeros(len(self.points),dtype=int)
+
+        self.events = []
+        self.count = 0
+        self.now = 0.0
+        self.evaluated = -1
+        self.records = {'point' : [],'arrival' : [],'wait' : []}
+
+    def _push(self,t,kind,point):
+        heapq.heappush(self.events,(t,kind,self.count,point))
+        self.count += 1
+
+    def _service(self,point):
+        s2 = max(self.queue_chars[self.points[point]]['S_SQUARED'],1e-9)
+        mean = 1/self.queue_chars[self.points[point]]['mean_service_time']
+        return self.rng.gamma(1/s2,mean*s2)
+
+    def _start(self,point,t):
+
+        # Serve waiting passengers while servers are free
+        queue = self.queues[point]
+        while queue and self.busy[point] < self.c[point]:
+            arrival = queue.popleft()
+            self._begin(point,arrival,t)
+
+    def _begin(self,point,arrival,t):
+        self.busy[point] += 1
+        self.started_wait[point] += t-arrival
+        self.started[point] += 1
+        self.records['point'].append(point)
+        self.records['arrival'].append(arrival)
+        self.records['wait'].append(t-arrival)
+        self._push(t+self._service(point),DEPART,point)
+
+    def _handle(self,t,kind,point):
+        if kind == ARRIVE:
+            if self.busy[point] < self.c[point] and not self.queues[point]:
+                self._begin(point,t,t)
+            else:
+                self.queues[point].append(t)
+        else:
+            self.busy[point] -= 1
+            chars = self.queue_chars[self.points[point]]
+
+            # Route the served passenger to the next point, the rest leave the terminal
+            if chars['trans_point']:
+                probs = np.asarray(chars['trans'],dtype=float)
+                if probs.ndim == 2:
+                    # Shares that change over the day hold one column per minute
+                    probs = probs[:,min(int(t),probs.shape[1]-1)]
+                choice = np.searchsorted(np.cumsum(probs),self.rng.random(),side='right')
+                if choice < len(probs):
+                    walk = chars.get('walk',0)
+                    self._push(t+walk,ARRIVE,self.index[chars['trans_point'][choice]])
+            self._start(point,t)
+
+    def _ingest(self,flows,st):
+
+        # People that reached a queue since the previous update; late records of past minutes join at the current time
+        l = np.zeros(self.seen.shape)
+        for point,idx in flows.index.items():
+            if point in self.index:
+                l[self.index[point],:] = flows.matrix[:self.horizon,idx]
+        new = np.rint(l[:,:st+1] - self.seen[:,:st+1]).astype(int)
+        self.seen[:,:st+1] = l[:,:st+1]
+        for point,minute in zip(*np.nonzero(new > 0)):
+            start = max(float(minute),self.now)
+            for t in start + self.rng.random(new[point,minute])*(minute+1-start):
+                self._push(t,ARRIVE,point)
+
+    def _record(self,minute):
+        for point in range(len(self.points)):
+            queue = self.queues[point]
+            if self.started[point] > 0:
+                self.W[point,minute] = self.started_wait[point]/self.started[point]
+            elif queue:
+                self.W[point,minute] = minute+1-queue[0]
+            else:
+                self.W[point,minute] = 0
+            self.L[point,minute] = len(queue)
+        self.started_wait[:] = 0
+        self.started[:] = 0
+
+        # Same staffing rule as get_queues, reviewed every 30 minutes
+        if "X-RAY" in self.index:
+            x = self.index["X-RAY"]
+            W,L = self.W[x,minute],self.L[x,minute]
+            if (W >=int(self.args.trigger) or L >=200) and (minute % 30 == 0):
+                self.c[x] = min(19,self.c[x]+int(self.args.increase)+2)
+            elif W <=2 and (minute % 30 == 0):
+                self.c[x] = max(self.min_open,self.c[x]-int(self.args.increase))
+            self.servers[minute] = self.c[x]
+            self._start(x,minute+1)
+
+    def advance(self,flows,st):
+
+        '''
+        Simulates the terminal up to the end of the examined minute:
+
+        Args:
+            flows (FlowMatrix) : Arrivals at the queues per minute and point
+            st (int) : Examined minute
+
+        Returns:
+            waiting_time (dict): Average waiting time per point and minute of the passengers starting their service
+            servers (np.array): Open X-RAY servers per minute
+            queue_people (dict): People in the queue per point at the end of every minute
+        '''
+        st = min(st,self.horizon-1)
+        if st > self.evaluated:
+            self._ingest(flows,st)
+            for minute in range(self.evaluated+1,st+1):
+                while self.events and self.events[0][0] < minute+1:
+                    t,kind,_,point = heapq.heappop(self.events)
+                    self.now = t
+                    self._handle(t,kind,point)
+                self.now = float(minute+1)
+                self._record(minute)
+            self.evaluated = st
+
+        waiting_time = {x : self.W[self.index[x]] if x in self.index else 0 for x in self.queue_chars.keys()}
+        queue_people = {x : self.L[self.index[x]] if x in self.index else 0 for x in self.queue_chars.keys()}
+        return waiting_time,self.servers,queue_people
+
+    def passenger_waits(self):
+
+        '''
+        Returns:
+            waits (pd.DataFrame): Point, arrival minute and waiting time (minutes) of every served passenger.
+        '''
+        return pd.DataFrame({'point' : np.array(self.points)[np.array(self.records['point'],dtype=int)],
+                             'arrival' : self.records['arrival'],'wait' : self.records['wait']})
+
+def compare_terminal_models(flows,queue_chars,args,engines,st=1440,step=10):
+
+    '''
+    Runs terminal models over the same arrivals with the update frequency of run_model, to validate the SBC approximation:
+
+    Args:
+        flows (FlowMatrix) : Arrivals at the queues per minute and point of the whole day
+        queue_chars (dict) : Queue characteristics for specific points in the airport
+        args (argparse.Namespace) : Configuration holding min_open, trigger and increase
+        engines (dict) : Name : constructor taking (queue_chars, args), e.g. {'sbc' : QueueEngine, 'des' : TerminalSimulator}
+        st (int) : Last examined minute
+        step (int) : Minutes between updates
+
+    Returns:
+        report (pd.DataFrame): Runtime, mean/maximum waiting time and queue per point, and maximum of open X-RAY servers per model.
+    '''
+    rows = []
+    for name,engine in engines.items():
+        model = engine(queue_chars,args)
+        start = time.time()
+        for minute in range(0,st+1,step):
+            waiting_time,servers,queue_people = model.advance(flows,minute)
+        runtime = time.time()-start
+
+        for point in model.points:
+            rows.append({'model' : name,'point' : point,'runtime (s)' : runtime,
+                         'mean wait' : float(np.mean(waiting_time[point][:st+1])),'max wait' : float(np.max(waiting_time[point][:st+1])),
+                         'mean queue' : float(np.mean(queue_people[point][:st+1])),'max queue' : float(np.max(queue_people[point][:st+1])),
+                         'max servers' : int(np.max(servers[:st+1]))})
+    return pd.DataFrame(rows)
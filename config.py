@@ -82,6 +82,19 @@ def get_config():
         action="store_true",
         )
 
+    child_12.add_argument(
+        "--arrivals",
+        metavar="Simulate arriving passengers travelling from MXP to Milano",
+        action="store_true",
+        )
+
+    child_12.add_argument(
+        "--pregenerated",
+        metavar="Load pregenerated demand for the examined date and seed",
+        help="Generate it beforehand with python -m Toolkit.demand_pregeneration",
+        action="store_true",
+        )
+
     group2 = parser.add_argument_group('Demand Related', gooey_options={'columns':3})
 
     group2.add_argument('--query-string2', help='the search string',gooey_options= {'visible': False})
@@ -134,6 +147,23 @@ def get_config():
 
 
 
+    child_22 = group2.add_argument_group('Sampling', gooey_options={'show_border': True,
+        'columns': 2,'margin_top' : 25})
+    child_22.add_argument(
+            "--seed",
+            metavar="Seed",
+            help="Seed of the generated demand.",
+            widget='IntegerField',
+            default=0,
+            type=int
+        )
+    child_22.add_argument(
+            "--scenario",
+            metavar="Flight schedule scenario",
+            help="Scaled schedule of the examined date (python -m Toolkit.demand_scaler); empty for the original.",
+            default=""
+        )
+
     child_1 = group2.add_argument_group('Passenger Behavior', gooey_options={'show_border': True,
         'columns': 2,'margin_top' : 25})
     child_1.add_argument(
@@ -240,6 +270,64 @@ def get_config():
         default=30
     )
 
+    child_41.add_argument(
+        "--queue_model",
+        metavar="Terminal queue model",
+        help="SBC approximation (sbc) or discrete-event simulation of every passenger (des).",
+        choices=["sbc","des"],
+        widget="Dropdown",
+        default="sbc"
+    )
+
+    child_41.add_argument(
+        "--staffing",
+        metavar="X-RAY staffing",
+        help="Threshold rule (rule) or fewest stands keeping the waiting time within the trigger, re-planned every step_x minutes (optimal).",
+        choices=["rule","optimal"],
+        widget="Dropdown",
+        default="rule"
+    )
+
+    child_41.add_argument(
+        "--airside",
+        metavar="Queue passport control and gates",
+        help="Route passengers from the X-RAY to passport control (non-Schengen) and to the gates of their flights.",
+        action="store_true",
+        )
+
+    child_41.add_argument(
+        "--passport_proc",
+        metavar="Amount of hourly users processed per passport desk",
+        help="Processing rate of passport control",
+        widget='Slider', gooey_options={
+            'min': 0, 
+            'max': 240, 
+            'increment': 1},
+        default=120
+    )
+
+    child_41.add_argument(
+        "--passport_desks",
+        metavar="Open passport desks",
+        help="Desks open at passport control",
+        widget='Slider', gooey_options={
+            'min': 1, 
+            'max': 20, 
+            'increment': 1},
+        default=6
+    )
+
+    child_41.add_argument(
+        "--gate_proc",
+        metavar="Amount of hourly users processed per gate",
+        help="Boarding rate of a gate",
+        widget='Slider', gooey_options={
+            'min': 0, 
+            'max': 800, 
+            'increment': 10},
+        default=400
+    )
+
 
 
     group6 = parser.add_argument_group('Disruptions - Train Cancelations', gooey_options={'columns':1})
@@ -5,8 +5,10 @@ import utm
 import calendar
 import time
 import openrouteservice
+from scipy.spatial import cKDTree
 import os
 import warnings
+from functools import partial
 warnings.filterwarnings("ignore")
 from datetime import datetime
 
@@ -22,10 +24,15 @@ from TransitRouting import GTFS_wrapper,build_transfer_file
 
 # Orchestra Toolkit
 from Toolkit.demand_generation import * 
+from Toolkit.demand_pregeneration import get_demand_path,read_cluster_demand,DemandPrefetcher
+from Toolkit.data_bundle import load_data_bundle
+from Toolkit.flight_index import build_flight_index,build_gate_index
 from Toolkit.network_represenentations import * 
 from Toolkit.dynamic_guidance import *
 from Toolkit.priority_balancing import * 
 from Toolkit.queue_decision_support import * 
+from Toolkit.terminal_simulation import TerminalSimulator
+from Toolkit.staffing_policy import plan_servers
 
 # Configuration
 from config import get_config
@@ -137,6 +144,7 @@ class Passenger(mesa.Agent):
         self.self_check = self_check
         self.max_transfer = max_transfer
         self.walking_radius = walking_radius
+        self.close_stations = None
 
         # Initialize various attributes
         self.proc_time = 0
@@ -165,13 +173,34 @@ class Passenger(mesa.Agent):
         '''
         Returns stations that are within the passenger's walking radius.
         '''
-        return [x for x in model.map.get_neighbors(self.pos, self.walking_radius) if isinstance(x, Station)]
+        if self.close_stations is None:
+            self.model.locate_stations([self])
+        return self.close_stations
 
     def calculate_time_to_station(self, stations):
         '''
         Calculates travel time to the first connection point; this is a rough approximation.
         '''
-        return [int(((model.map.get_distance(self.pos, x.pos)) / (60 * 0.8))) for x in stations]
+        return [int(np.hypot(self.pos[0] - x.pos[0], self.pos[1] - x.pos[1]) / (60 * 0.8)) for x in stations]
+
+class ArrivingPassenger(Passenger):
+    '''
+    ArrivingPassenger class represents a passenger leaving MXP towards the Milano area.
+    '''
+
+    def __init__(self, unique_id, model, lonlat, pos, persons, activation, flight, arrival, NIL, gate, passport, bags, car, max_transfer=3, walking_radius=500):
+        """
+        Initialize an ArrivingPassenger object.
+
+        :param lonlat: Longitude and latitude of the passenger's destination.
+        :param pos: Coordinates in the UTM format (X, Y) of the passenger's destination.
+        :param activation: Time (minutes from midnight) that the passenger leaves the terminal.
+        :param arrival: Time (minutes from midnight) that the associated flight lands.
+        :param car: Whether the passenger is picked up by car.
+        """
+        super().__init__(unique_id, model, lonlat, pos, persons, activation, flight, None, NIL, gate, passport, bags, False, max_transfer, walking_radius)
+        self.arrival = arrival
+        self.car = car
 
 
 class Milano(mesa.Model):
@@ -212,8 +241,11 @@ class Milano(mesa.Model):
         self.x_min, self.y_min, self.x_max, self.y_max = 470343.91, 5012125.44, 577043.51, 5075971.36
 
 
+        # Static inputs are read from the compiled data bundle (python -m Toolkit.data_bundle)
+        bundle = load_data_bundle()
+
         # Load transit nodes data
-        self.transit_nodes = pd.read_csv('data/mxp/transit_stops.csv', index_col=0).to_dict(orient='index')
+        self.transit_nodes = bundle['transit_stops'].to_dict(orient='index')
        
 
         for x in self.transit_nodes.keys():
@@ -240,33 +272,46 @@ class Milano(mesa.Model):
         self.bags_pax = 0
         
         # Parameters to be loaded locally
-        data_folder = f"data/mxp/{self.month_name}/{self.date_str}/"
+        data_folder = os.path.join(f"data/mxp/{self.month_name}/{self.date_str}", args.scenario, "")
         self.departures_matrix = pd.read_csv(data_folder + "departures_matrix.csv", index_col=0)
         self.departures_plan = pd.read_csv(data_folder + "departures_plan.csv")
         self.arrivals_matrix = pd.read_csv(data_folder + "arrivals_matrix.csv", index_col=0)
         self.arrivals_plan = pd.read_csv(data_folder + "arrivals_plan.csv")
-        self.pop_data = pd.read_excel("data/milano/milano_population_data.xlsx")
-        self.polygons = gpd.read_file('data/milano/nils_milano.geojson')
-        self.varese_pop = pd.read_excel("data/milano/varese_population_data.xlsx")
-        self.arr_to_check = pd.read_excel("data/mxp/arr_to_checkin.xlsx",index_col=0)
-        self.arr_to_xray= pd.read_excel("data/mxp/arr_to_xray.xlsx",index_col=0)
+
+        self.pop_data = bundle['pop_data']
+        self.polygons = bundle['polygons']
+        self.point_pools = load_point_pools(self.polygons)
+        self.varese_pop = bundle['varese_pop']
+        self.pop_distribution = get_population_distribution(self.pop_data, self.varese_pop)
+        self.arr_to_check = bundle['arr_to_check']
+        self.arr_to_xray= bundle['arr_to_xray']
+
+        # Flight and gate metadata indexed once for the hot paths, before the demand inputs that hold them
+        self.flight_index = build_flight_index(self.departures_plan)
+        self.arrivals_index = build_flight_index(self.arrivals_plan)
+        self.gate_index = build_gate_index(self.arr_to_check)
+        self.demand_path = get_demand_path(self.month_name, self.date_str, args.seed, 'departures', args.scenario)
+        self.demand_inputs = {'date_str': self.date_str, 'month_name': self.month_name, 'passenger_data': self.departures_matrix,
+                              'flight_data': self.departures_plan, 'pop_data': self.pop_data, 'varese_pop': self.varese_pop,
+                              'polygons': self.polygons, 'pools': self.point_pools, 'distribution': self.pop_distribution,
+                              'flight_index': self.flight_index}
+
+        # Arriving passengers are generated by the same pipeline from the arrivals matrix
+        self.arrivals_path = get_demand_path(self.month_name, self.date_str, args.seed, 'arrivals', args.scenario)
+        self.arrivals_inputs = dict(self.demand_inputs, passenger_data=self.arrivals_matrix, flight_data=self.arrivals_plan,
+                                    flight_index=self.arrivals_index)
+        self.arr_distr = pd.DataFrame()
+
+        # Car travel times from the origin regions to the transit points (first mile)
+        self.first_mile = get_first_mile_matrix(self.client,self.polygons,self.varese_pop,self.transit_nodes)
+        self.first_mile_times = {int(k): v for k,v in zip(self.first_mile.index,np.nan_to_num(self.first_mile.to_numpy(),nan=np.inf))}
+        self.transit_names = np.array(list(self.transit_nodes.keys()))
+        self.transit_modes = np.array([self.transit_nodes[x]['mode'] for x in self.transit_names])
 
         # Set Processing rates
-        self.waiting_time = {}
-        self.waiting_time["X-RAY"]= 0
-        self.queue_chars = {f'C{i}': {'mean_service_time':int(args.check_in_proc)/60, "S_SQUARED": (0-2) ** 2 / 12, 'trans': [1],
-                                "trans_point": ["X-RAY"]} for i in range(1, 12)}
-        self.queue_chars['CAR'] = {}
-        self.queue_chars['TRAIN'] = {}
-
-        for i in range(1,12):
-            self.queue_chars[f'C{i}']['walk'] = self.arr_to_xray.loc[i]['Time (min)']
-            self.waiting_time[f'C{i}']= 0
-
-        self.queue_chars['CAR']['walk'] = self.arr_to_xray.loc['CAR']['Time (min)']
-        self.queue_chars['TRAIN']['walk'] = self.arr_to_xray.loc['TRAIN']['Time (min)']
-        self.queue_chars["X-RAY"] = {'mean_service_time': int(args.x_ray_proc)/60, "S_SQUARED": (1 - 4) ** 2 / 12, 'trans': [],
-                            "trans_point": []}
+        self.waiting_time = {x: 0 for x in ["X-RAY"] + [f'C{i}' for i in range(1, 12)]}
+        self.queue_chars = get_queue_chars(self.arr_to_xray, args.check_in_proc, args.x_ray_proc,
+                                           self.departures_plan if args.airside else None, args.passport_proc, args.passport_desks, args.gate_proc)
         self.delay = 0
         self.delay_lines = {}  
         self.store_generated = pd.DataFrame()
@@ -331,8 +376,10 @@ class Milano(mesa.Model):
             }
         )
  
-        # Load Station agents from file
-        stat_distr = pd.read_csv('data/milano/stations_all.csv', delimiter=',').values
+        # Load Station agents from the data bundle
+        stat_distr = bundle['stations_all'].values
+        self.station_ids = stat_distr[:, 0].astype(int)
+        self.station_tree = cKDTree(stat_distr[:, 4:6].astype(float))
         for idx in range(stat_distr.shape[0]):
             x, y = stat_distr[idx][4], stat_distr[idx][5]
             name = stat_distr[idx][1]
@@ -352,6 +399,7 @@ class Milano(mesa.Model):
 
         :param pass_distr (pd.DataFrame): Exact trip information for passengers at this time-window 
         '''
+        passengers = []
         for _, r in pass_distr.iterrows():
 
             # Create a Passenger agent
@@ -371,11 +419,43 @@ class Milano(mesa.Model):
                 r[12]  # Self-Check
             )
 
-            # Place agent on the map and schedule
-            self.map.place_agent(passenger, (r[2], r[3]))
+            # Add agent to the schedule; stations are located through the KD-tree instead of the map
+            self.schedule.add(passenger)
+            passengers.append(passenger)
+            self.pax_id += 1
+
+        self.locate_stations(passengers)
+
+    def place_arriving_agent(self, arr_distr):
+        '''
+        Initializes ArrivingPassenger agents for the current step; stations are located for the whole batch at once
+
+        :param arr_distr (pd.DataFrame): Exact trip information for arriving passengers leaving the terminal at this step
+        '''
+        passengers = []
+        for r in arr_distr.itertuples(index=False):
+            passenger = ArrivingPassenger(f'A{self.pax_id}', self, (r[1], r[0]), (r[2], r[3]), r[4], r[5], r[6], r[7], r[8], r[9], r[10], r[11], r[12])
             self.schedule.add(passenger)
+            passengers.append(passenger)
             self.pax_id += 1
 
+        self.locate_stations(passengers)
+        return passengers
+
+    def locate_stations(self, passengers):
+        '''
+        Stores the stations within the walking radius of a batch of Passenger agents with a single KD-tree query.
+
+        :param passengers (list): Passenger agents activated in the current step.
+        '''
+        if len(passengers) == 0:
+            return
+        coords = np.array([p.pos for p in passengers], dtype=float)
+        radius = np.array([p.walking_radius for p in passengers], dtype=float)
+        stations = self.schedule.agents_by_type[Station]
+        for passenger, close in zip(passengers, self.station_tree.query_ball_point(coords, radius)):
+            passenger.close_stations = [stations[self.station_ids[x]] for x in close]
+
     def get_KPI(self, agent, KPI):
         '''
         Get Key Performance Indicator (KPI) for a specific Passenger agent.
@@ -410,7 +490,16 @@ class Milano(mesa.Model):
 
         '''
         # Initialize/Load log file for pre-exisiting traffic 
-        flow_update = {}
+        # Queues keep their state between updates and only advance over the new minutes
+        if self.args.queue_model == "des":
+            queue_engine = TerminalSimulator(self.queue_chars, self.args, rng=self.args.seed)
+        else:
+            staffing = None
+            if self.args.staffing == "optimal":
+                staffing = partial(plan_servers, target=int(self.args.trigger), min_open=int(self.args.min_open),
+                                   step=int(self.args.step_x), blocks=1)
+            queue_engine = QueueEngine(self.queue_chars, self.args, staffing=staffing)
+        flow_update = FlowMatrix(queue_engine.points)
         station_update = {}
         line_update = {}
         modes_track = {'CAR':0,"TRAIN" :0, "COACH" :0,"TAXI" :0}
@@ -424,6 +513,13 @@ class Milano(mesa.Model):
         self.track_st = self.args.min_open
         term_announce = ""
         keep_extra = ""
+
+        # Upcoming clusters are generated in the background while the current time-window is simulated
+        if not self.args.pregenerated:
+            demand_prefetcher = DemandPrefetcher(self.demand_inputs, self.args.seed)
+            if self.args.arrivals:
+                arrivals_prefetcher = DemandPrefetcher(self.arrivals_inputs, self.args.seed, 'arrivals')
+
         for st in range(step_count):
 
             if st < 7*60 or st >=20*60:
@@ -441,16 +537,11 @@ class Milano(mesa.Model):
 
             # Determine if road is experiencing a disruption now
             road_show = {}           
-            model.active_road_disruption = []
-            if model.args.road_disruption_N != []:
-                
-                if model.schedule.steps in model.disruption_range_N:
-                    model.active_road_disruption = model.args.road_disruption_N
+            model.active_road_disruption = model.road_profile.at(model.schedule.steps)
+            if model.active_road_disruption != []:
+                if 'SS336_N' in model.active_road_disruption['names']:
                     road_show['north'] = "Delays on SS336 - North Side"
-
-            if model.args.road_disruption_S != []:
-                if model.schedule.steps in model.disruption_range_S:
-                    model.active_road_disruption = model.args.road_disruption_S
+                if 'SS336_S' in model.active_road_disruption['names']:
                     road_show['south'] = "Delays on SS336 - South Side"
 
             # Initialize State prior to simulation start
@@ -459,30 +550,48 @@ class Milano(mesa.Model):
                 self.cluster = 1 + self.schedule.steps // self.window_len
                 self.flights = self.departures_matrix[str(self.cluster)]
                 
-                pass_dem = generate_passenger_demand(self.pop_data, self.departures_matrix, str(self.cluster),
-                                                    self.date_str, self.varese_pop)
-                pass_distr = demand_to_flight(self.date_str, self.cluster, pass_dem, self.departures_matrix,
-                                            self.polygons, self.varese_pop, self.departures_plan)
+                # Stream the cluster from the pregenerated demand or take it from the background generation
+                if self.args.pregenerated:
+                    pass_distr = read_cluster_demand(self.demand_path, self.cluster)
+                else:
+                    pass_distr = demand_prefetcher.get(self.cluster)
+
+                # Arriving passengers may leave the terminal after the end of their cluster, so pending ones are kept
+                if self.args.arrivals:
+                    if self.args.pregenerated:
+                        arr_new = read_cluster_demand(self.arrivals_path, self.cluster)
+                    else:
+                        arr_new = arrivals_prefetcher.get(self.cluster)
+                    if len(self.arr_distr) > 0:
+                        self.arr_distr = self.arr_distr[self.arr_distr['activation_time'] >= st]
+                    self.arr_distr = pd.concat([self.arr_distr, arr_new], axis=0, ignore_index=True)
                 
                 # Initialize State of the airport before Simulation
                 if st < start and model.args.initial_state:
                     pass_distr = initial_state(self,pass_distr)                                
-                    for agent, r in pass_distr.iterrows():
-                        flow_update = update_flows(self,r.MODE,r.Bags,r.Gate,r.no_persons,r.ARR_TIME,flow_update)
-                        modes_track[r.MODE] +=r.no_persons
-                        arrs[r.ARR_TIME] += r.no_persons
-                        tot_arrs += r.no_persons
-                        MISSED,_,proc_time = update_safety_margins(self,r.ARR_TIME,r.departure-r.activation_time,r.Bags,r.MODE,r.Gate,r.ARR_TIME)
-                        avg_proc.append(proc_time)
-                        self.exits[r.departure] += r.no_persons
-                        self.MISSED += MISSED
-                        if r.Passport:
-                            self.non_schengen +=r.no_persons
-                        else:
-                            self.schengen +=r.no_persons
-
-                        if r.Bags:    
-                            self.bags_pax += r.no_persons
+                    persons = pass_distr['no_persons'].to_numpy()
+                    passport = pass_distr['Passport'].to_numpy(dtype=bool)
+                    bags = pass_distr['Bags'].to_numpy(dtype=bool)
+
+                    # Safety margins of the whole cohort at once, everyone is evaluated at their own arrival
+                    MISSED,_,proc_time = update_safety_margins_cohort(self,pass_distr['ARR_TIME'].to_numpy(),
+                                                                      (pass_distr['departure']-pass_distr['activation_time']).to_numpy(),
+                                                                      bags,pass_distr['MODE'].to_numpy(),pass_distr['Gate'].to_numpy(),
+                                                                      pass_distr['ARR_TIME'].to_numpy(),passport)
+                    avg_proc.extend(proc_time.tolist())
+                    self.MISSED += int(MISSED.sum())
+
+                    for mode,bag,gate,no_persons,arr_time,departure in zip(pass_distr['MODE'].tolist(),bags.tolist(),pass_distr['Gate'].tolist(),
+                                                                           persons.tolist(),pass_distr['ARR_TIME'].tolist(),pass_distr['departure'].tolist()):
+                        flow_update = update_flows(self,mode,bag,gate,no_persons,arr_time,flow_update)
+                        modes_track[mode] +=no_persons
+                        arrs[arr_time] += no_persons
+                        self.exits[departure] += no_persons
+
+                    tot_arrs += int(persons.sum())
+                    self.non_schengen += int(persons[passport].sum())
+                    self.schengen += int(persons[~passport].sum())
+                    self.bags_pax += int(persons[bags].sum())
 
                     # Concatenate along rows (axis=0)
                     self.store_generated = pd.concat([self.store_generated, pass_distr], axis=0)
@@ -519,7 +628,7 @@ class Milano(mesa.Model):
                             agent.E_TIME += pd.Timedelta(minutes=model.delay_lines[agent.LINE_USED])
                             agent.SAFETY_MARGIN -=  model.delay_lines[agent.LINE_USED]
 
-                        MISSED,agent.SAFETY_MARGIN,agent.proc_time = update_safety_margins(self,agent.ARR_TIME,agent.SAFETY_MARGIN,agent.bags,agent.MODE,agent.gate,agent.ARR_TIME)
+                        MISSED,agent.SAFETY_MARGIN,agent.proc_time = update_safety_margins(self,agent.ARR_TIME,agent.SAFETY_MARGIN,agent.bags,agent.MODE,agent.gate,agent.ARR_TIME,agent.passport)
                         avg_proc.append(agent.proc_time)
                         if MISSED == 0 :
                             self.exits[agent.departure] += agent.persons
@@ -530,18 +639,22 @@ class Milano(mesa.Model):
                             self.schengen +=agent.persons
                         if agent.bags:    
                             self.bags_pax += agent.persons 
+
+                # Arriving passengers load the Milano-bound lines and roads
+                if self.args.arrivals and len(self.arr_distr) > 0:
+                    arr_cur = self.arr_distr[self.arr_distr['activation_time'] == st]
+                    arriving = self.place_arriving_agent(arr_cur)
+                    assign_arrivals(arriving, self)
+                    for agent in arriving:
+                        if agent.LINE_USED != None and agent.LINE_USED != 'None':
+                            line_update[agent.LINE_USED] = line_update.get(agent.LINE_USED, 0) + agent.persons
             report_metrics = {"en_route" : tot_arrs-sum(arrs[0:st]),"mxp" : sum(arrs[0:st])-sum(self.exits[0:st]), "left" : sum(self.exits[0:st]), 'missed' : self.MISSED,
                               "schengen" : self.schengen,"non_schengen" : self.non_schengen, "Luggage" : self.bags_pax}
             
             # Update Queues every n minutes
             if self.schedule.steps % 10 == 0:
-                flows = {k: v for (k, v) in flow_update.items() if k[0] <= self.schedule.steps}
-                dataset = pd.Series(flows)
-                if flows != {}:
-                    f_df = pd.DataFrame.from_dict(flows, orient='index')
-                    f_df = dataset.unstack()
-                    f_df = f_df.fillna(1e-16)
-                    self.waiting_time,servers,queue_people = get_queues(f_df, self.queue_chars,self)
+                if flow_update.any(self.schedule.steps):
+                    self.waiting_time,servers,queue_people = queue_engine.advance(flow_update, st)
                     keys = self.waiting_time.keys()
                     values = [round(x[st]) if type(x) != int else 0 for x in self.waiting_time.values()]
                     self.waiting_time= dict(zip(keys, values))
@@ -633,6 +746,11 @@ class Milano(mesa.Model):
                         json.dump(save, file)
                     break 
 
+        if not self.args.pregenerated:
+            demand_prefetcher.close()
+            if self.args.arrivals:
+                arrivals_prefetcher.close()
+
             
          
 if __name__ == "__main__":
@@ -643,6 +761,7 @@ if __name__ == "__main__":
     # Open OpenRouteService and initiate client
     open_ORS()
     client = openrouteservice.Client(base_url='http://localhost:8080/ors')
+    warm_up_ORS(client)
 
     # Transform date to be readable from GTFS wrapper
     year, month, day = args.date.split("-")
@@ -689,43 +808,21 @@ if __name__ == "__main__":
     if args.break_station != 'None':
         get_affected_line(model,failures,args.break_station,st = args.break_time)
 
-    # Insert Road Disruptions
-    model.disruption_range = range(1)
-    model.args.road_disruption_S = []
-    model.args.road_disruption_N = []
-    for y in range(2):
-        if (args.speed_reduction >0.0 and y == 0) or (args.speed_reduction_S >0.0 and y == 1):
-            if y == 0:
-                disruption = {'name':'SS336_N','perc_road':0.75,"slow_down" : True, "slow_down_perc" : (1-float(args.speed_reduction)+0.0001)**(-1)}
-            else:
-                disruption = {'name':'SS336_S','perc_road':0.75,"slow_down" : True, "slow_down_perc" : (1-float(args.speed_reduction_S)+0.0001)**(-1)}
-
-        try:
-            if disruption['perc_road'] !=0:
-                dis_poly,dis_plot,disruption['edges_speed'] = insert_disruption_road(client,disruption['name'],disruption['perc_road'],disruption['slow_down'],disruption['slow_down_perc'])
-                disruption['avoid_polygon'] = {"coordinates": [dis_poly],"type": "Polygon"}
-                if y == 0:
-                    model.args.road_disruption_N = disruption
-                    from datetime import datetime
-                    time_object  = datetime.strptime(model.args.disruption_time_road.split(';')[0], '%H:%M')      
-                    road_start = time_object .hour * 60 + time_object .minute
-                    time_object  = datetime.strptime(model.args.disruption_time_road.split(';')[1], '%H:%M')
-                    road_finish = time_object .hour * 60 + time_object.minute
-                    model.disruption_range_N = range(road_start,road_finish)
-                else:
-                    model.args.road_disruption_S = disruption
-                    from datetime import datetime
-                    time_object  = datetime.strptime(model.args.disruption_time_road_S.split(';')[0], '%H:%M')      
-                    road_start = time_object .hour * 60 + time_object .minute
-                    time_object  = datetime.strptime(model.args.disruption_time_road_S.split(';')[1], '%H:%M')
-                    road_finish = time_object .hour * 60 + time_object.minute
-                    model.disruption_range_S = range(road_start,road_finish)                
-        except:
-            pass
+    # Insert Road Disruptions as time-dependent speed profiles
+    model.road_profile = RoadSpeedProfile()
+    road_disruptions = {'SS336_N' : (args.speed_reduction,args.disruption_time_road),
+                        'SS336_S' : (args.speed_reduction_S,args.disruption_time_road_S)}
+    for name,(reduction,period) in road_disruptions.items():
+        if float(reduction) > 0.0:
+            try:
+                dis_poly,dis_plot,factor = insert_disruption_road(client,name,0.75,True,(1-float(reduction)+0.0001)**(-1))
+                road_start,road_finish = [pd.to_datetime(x, format='%H:%M') for x in period.split(';')[0:2]]
+                model.road_profile.add_disruption(name,dis_poly,road_start.hour * 60 + road_start.minute,
+                                                  road_finish.hour * 60 + road_finish.minute,factor)
+            except:
+                pass
     model.args.delay_line = 1
 
-    #model.disruption_range_S = range(1)
-    model.disruption_range_N = range(1)
     # Initialize the Map
     if model.args.visualization:
         
@@ -763,6 +860,14 @@ if __name__ == "__main__":
     CAR_AGENTS = CAR_AGENTS.drop(['ACCESS_TIME'],axis=1)
     CAR_AGENTS.to_excel(f'data/passengers/{model.month_name}/{model.date_str}/CAR_{start}_{steps}.xlsx')
 
+    # Save trips of arriving passengers towards Milano
+    if args.arrivals:
+        ARR_AGENTS = pd.DataFrame([{'FLIGHT': a.flight, 'ARRIVAL': a.arrival, 'ACTIVATION': a.activation, 'REGION': a.NIL,
+                                    'NO_PERSONS': a.persons, 'MODE': a.MODE, 'LINE_USED': a.LINE_USED, 'TRANSIT_STATION': a.TRANSIT_STATION_NAME,
+                                    'TRAVEL_TIME': a.TRAVEL_TIME, 'END_TIME': a.E_TIME, 'DISTANCE': a.DISTANCE_CAR}
+                                   for a in model.schedule.agents_by_type[ArrivingPassenger].values()])
+        ARR_AGENTS.to_excel(f'data/passengers/{model.month_name}/{model.date_str}/ARR_{start}_{steps}.xlsx')
+
 
     close_ORS()
 